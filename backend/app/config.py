@@ -1,7 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
 from typing import Optional
-import os
 
 
 class Settings(BaseSettings):
@@ -40,6 +39,17 @@ class Settings(BaseSettings):
     # Queue settings
     max_concurrent_tasks: int = 2
     retry_count: int = 3
+    # Limits on the lines and characters of one translation batch; 0 uses
+    # the built-in defaults
+    batch_max_count: int = 0
+    batch_max_chars: int = 0
+    # Batches of one file sent to the LLM at once; 0 uses the provider default
+    translation_concurrency: int = 0
+    # LLM requests and tokens per minute; 0 means no fixed limit. Either
+    # way, 429 responses pause requests and space them out until successful
+    # requests bring the rate back up.
+    llm_rpm_limit: int = 0
+    llm_tpm_limit: int = 0
 
     # Directories
     temp_dir: str = Field(default="./data/temp")
@@ -55,6 +65,26 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# Ensure directories exist
-os.makedirs(settings.temp_dir, exist_ok=True)
-os.makedirs("./data", exist_ok=True)
+
+# Strings treated as true when parsing stored boolean settings
+TRUTHY_STRINGS = frozenset({"true", "1", "yes", "on", "y"})
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in TRUTHY_STRINGS
+    return bool(value)
+
+
+# Declared type of each setting, computed once for coercing stored values
+SETTING_TYPES = {
+    name: field.annotation for name, field in Settings.model_fields.items()
+}
+
+_COERCERS = {bool: _to_bool, int: int}
+
+
+def coerce_setting(key: str, value):
+    """Convert a value stored in app_settings to the setting's type."""
+    coercer = _COERCERS.get(SETTING_TYPES[key])
+    return coercer(value) if coercer else value
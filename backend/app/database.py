@@ -4,12 +4,55 @@ from contextlib import asynccontextmanager
 
 DATABASE_PATH = "./data/tasks.db"
 
+# Per-connection tuning: WAL lets readers run alongside the writer, NORMAL sync
+# drops the extra fsync per commit, and the larger cache/mmap keep hot pages in
+# memory.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+async def _configure(db: aiosqlite.Connection):
+    """Apply connection-level PRAGMAs."""
+    for pragma in _PRAGMAS:
+        await db.execute(pragma)
+
+
+async def _connect() -> aiosqlite.Connection:
+    """Open a tuned connection to the application database."""
+    db = await aiosqlite.connect(DATABASE_PATH, isolation_level=None, timeout=5.0)
+    await _configure(db)
+    return db
+
+
+# SQL expression for the current UTC time. Same "YYYY-MM-DD HH:MM:SS" format
+# as the CURRENT_TIMESTAMP column defaults, so timestamps in a row compare and
+# sort consistently; datetime.fromisoformat reads it.
+SQL_NOW = "CURRENT_TIMESTAMP"
+
+# Idle connections kept open between get_db() calls, one per CPU (at least
+# 4). Callers beyond this many concurrent users get an extra connection that
+# is closed on release.
+POOL_SIZE = max(os.cpu_count() or 1, 4)
+
+# Rows kept in translation_cache; the least recently used are deleted at
+# startup
+TRANSLATION_CACHE_MAX_ROWS = 200_000
+_pool: list[aiosqlite.Connection] = []
+
 
 async def init_db():
     """Initialize database tables."""
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    db = await _connect()
+    try:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS tasks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,25 +108,111 @@ async def init_db():
             )
         """)
 
+        # Translations of individual subtitle lines, keyed by a hash of
+        # provider, model, languages and source text. accessed_at is a Unix
+        # time used to prune the table.
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS translation_cache (
+                key TEXT PRIMARY KEY,
+                translated TEXT NOT NULL,
+                accessed_at INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Migration: add accessed_at column if it doesn't exist
+        try:
+            await db.execute(
+                "ALTER TABLE translation_cache ADD COLUMN accessed_at INTEGER NOT NULL DEFAULT 0"
+            )
+        except Exception:
+            pass  # Column already exists
+
+        await db.execute(
+            """
+            DELETE FROM translation_cache WHERE key IN (
+                SELECT key FROM translation_cache
+                ORDER BY accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (TRANSLATION_CACHE_MAX_ROWS,),
+        )
+
         # Add indexes for faster lookups
         await db.execute("""
             CREATE INDEX IF NOT EXISTS idx_tasks_file_language
             ON tasks(file_path, target_language)
         """)
+        # Partial index for the active-task lookups done before creating tasks.
+        # Queries must spell the statuses as literals for SQLite to use it.
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tasks_active
+            ON tasks(file_path, target_language)
+            WHERE status IN ('pending', 'processing')
+        """)
+        # Queue claims and status-filtered listings, both ordered by created_at
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_tasks_status_created
+            ON tasks(status, created_at)
+        """)
         await db.execute("""
             CREATE INDEX IF NOT EXISTS idx_translated_files_lookup
             ON translated_files(file_path, target_language)
         """)
 
         await db.commit()
+    finally:
+        await db.close()
 
 
 @asynccontextmanager
 async def get_db():
-    """Get database connection."""
-    db = await aiosqlite.connect(DATABASE_PATH)
-    db.row_factory = aiosqlite.Row
+    """Get a pooled database connection."""
+    if _pool:
+        db = _pool.pop()
+    else:
+        db = await _connect()
+        db.row_factory = aiosqlite.Row
+
     try:
         yield db
     finally:
+        await _release(db)
+
+
+async def _release(db: aiosqlite.Connection):
+    """Return a connection to the pool, closing it if it cannot be reused."""
+    try:
+        # Never hand out a connection with a transaction left open
+        if db.in_transaction:
+            await db.rollback()
+    except Exception:
         await db.close()
+        return
+
+    if len(_pool) < POOL_SIZE:
+        _pool.append(db)
+    else:
+        await db.close()
+
+
+async def close_db():
+    """Close all idle pooled connections."""
+    while _pool:
+        await _pool.pop().close()
+
+
+@asynccontextmanager
+async def write_transaction(db: aiosqlite.Connection):
+    """Run a block of writes inside a BEGIN IMMEDIATE transaction.
+
+    Taking the write lock up front avoids SQLITE_BUSY upgrades when several
+    connections finish work at the same time.
+    """
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        await db.rollback()
+        raise
+    await db.commit()
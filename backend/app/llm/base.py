@@ -1,6 +1,58 @@
+import hashlib
+import json
+import logging
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import AsyncIterator
 from dataclasses import dataclass
+import httpx
+from ..config import settings
+from ..database import get_db, write_transaction
+from ..services.rate_limiter import AsyncLeakyBucket, estimate_tokens, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Entries kept in the in-process translation cache (backed by the
+# translation_cache table, which survives restarts)
+TRANSLATION_CACHE_SIZE = 10000
+_translation_cache: OrderedDict[str, str] = OrderedDict()
+
+# SQL expression for the current Unix time, stored in accessed_at
+SQL_UNIX_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# Connection pool limits for the HTTP clients shared by provider SDK clients
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+_http_clients: list[httpx.AsyncClient] = []
+
+
+def new_http_client() -> httpx.AsyncClient:
+    """Create a keep-alive HTTP/2 client for an LLM SDK client."""
+    client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True)
+    _http_clients.append(client)
+    return client
+
+
+async def close_http_clients():
+    """Close every HTTP client handed out by new_http_client."""
+    while _http_clients:
+        await _http_clients.pop().aclose()
+
+
+SYSTEM_PROMPT = (
+    "You are a professional subtitle translator. "
+    "Translate accurately while maintaining natural flow."
+)
+
+# Static instructions for batch translation. Kept separate from the per-call
+# lines so providers with prompt caching can send them as a stable prefix.
+BATCH_TRANSLATION_RULES = """Rules:
+1. Keep translations natural and fluent
+2. Preserve the original meaning and tone
+3. Keep any formatting tags like {\\an8} or {\\pos(x,y)}
+4. Output ONLY the translations, one per line, with the same numbering format [n]
+5. Do not add any explanations"""
 
 
 @dataclass
@@ -13,6 +65,37 @@ class TranslationResult:
 class BaseLLM(ABC):
     """Base class for LLM providers."""
 
+    provider: str = ""
+    model: str = ""
+    # Batch requests a single file translation keeps in flight
+    max_concurrency: int = 4
+    # Provider requests and tokens per minute, 0 for no limit
+    rpm_limit: int = 0
+    tpm_limit: int = 0
+
+    @property
+    def rate_limiter(self) -> AsyncLeakyBucket:
+        """The limiter shared by all requests to this provider."""
+        return get_rate_limiter(
+            self.provider,
+            settings.llm_rpm_limit or self.rpm_limit,
+            settings.llm_tpm_limit or self.tpm_limit,
+        )
+
+    @asynccontextmanager
+    async def rate_limited(self, texts: list[str]):
+        """Wait for rate limit budget to send texts, then record the outcome."""
+        limiter = self.rate_limiter
+        await limiter.acquire(tokens=estimate_tokens(texts))
+        try:
+            yield
+        except Exception as e:
+            # Both provider SDKs put the HTTP status on their API errors
+            if getattr(e, "status_code", None) == 429:
+                limiter.penalize()
+            raise
+        limiter.reward()
+
     @abstractmethod
     async def translate(
         self,
@@ -33,6 +116,68 @@ class BaseLLM(ABC):
         """Translate a batch of texts."""
         pass
 
+    async def translate_batch_cached(
+        self,
+        texts: list[str],
+        source_language: str,
+        target_language: str,
+    ) -> list[str]:
+        """Translate a batch, reusing cached results for repeated lines.
+
+        Identical lines are sent to the provider only once per batch, and
+        lines translated before (in memory or in the database) are not sent
+        at all.
+        """
+        keys = [
+            self._cache_key(text, source_language, target_language)
+            for text in texts
+        ]
+        results: dict[str, str] = {}
+        pending: dict[str, str] = {}
+
+        for key, text in zip(keys, texts):
+            if key in results or key in pending:
+                continue
+            if not text.strip():
+                results[key] = text
+            elif key in _translation_cache:
+                _translation_cache.move_to_end(key)
+                results[key] = _translation_cache[key]
+            else:
+                pending[key] = text
+
+        if pending:
+            for key, translated in (await _load_cached(list(pending))).items():
+                _remember(key, translated)
+                results[key] = translated
+                del pending[key]
+
+        if pending:
+            pending_texts = list(pending.values())
+            async with self.rate_limited(pending_texts):
+                translated_texts = await self.translate_batch(
+                    pending_texts, source_language, target_language
+                )
+            new_rows = []
+            for key, translated in zip(pending, translated_texts):
+                results[key] = translated
+                # Empty results come from unparseable responses; retry them
+                if translated:
+                    _remember(key, translated)
+                    new_rows.append((key, translated))
+            await _store_cached(new_rows)
+
+        return [results.get(key, "") for key in keys]
+
+    def _cache_key(
+        self, text: str, source_language: str, target_language: str
+    ) -> str:
+        """Build the translation cache key for a line."""
+        raw = "\0".join(
+            (self.provider, self.model, source_language, target_language, text)
+        )
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
     def _build_translation_prompt(
         self,
         text: str,
@@ -64,6 +209,22 @@ Translation:"""
         target_language: str,
     ) -> str:
         """Build prompt for batch translation."""
+        header, lines = self._build_batch_prompt_parts(
+            texts, source_language, target_language
+        )
+        return f"""{header}
+
+{BATCH_TRANSLATION_RULES}
+
+{lines}"""
+
+    def _build_batch_prompt_parts(
+        self,
+        texts: list[str],
+        source_language: str,
+        target_language: str,
+    ) -> tuple[str, str]:
+        """Build the per-call parts of the batch prompt (header and lines)."""
         source_str = (
             f"from {source_language}" if source_language != "auto" else ""
         )
@@ -71,16 +232,88 @@ Translation:"""
             f"[{i+1}] {text}" for i, text in enumerate(texts)
         )
 
-        return f"""Translate the following subtitle lines {source_str} to {target_language}.
-
-Rules:
-1. Keep translations natural and fluent
-2. Preserve the original meaning and tone
-3. Keep any formatting tags like {{\\an8}} or {{\\pos(x,y)}}
-4. Output ONLY the translations, one per line, with the same numbering format [n]
-5. Do not add any explanations
-
-Lines to translate:
+        header = f"Translate the following subtitle lines {source_str} to {target_language}."
+        lines = f"""Lines to translate:
 {numbered_texts}
 
 Translations:"""
+        return header, lines
+
+    @staticmethod
+    def _parse_batch_response(response: str, expected_count: int) -> list[str]:
+        """Parse a numbered batch translation response."""
+        translations = []
+
+        for line in response.strip().split("\n"):
+            stripped = line.strip()
+            # "[n] text" -> "text"
+            if (
+                stripped[:1] == "["
+                and (end := stripped.find("]")) > 1
+                and stripped[1:end].isdecimal()
+            ):
+                translations.append(stripped[end + 1:].lstrip())
+            elif stripped and not line.startswith("["):
+                # Fallback: line without numbering
+                translations.append(stripped)
+
+        # Ensure we have the expected number of translations
+        while len(translations) < expected_count:
+            translations.append("")
+
+        return translations[:expected_count]
+
+
+def _remember(key: str, translated: str):
+    """Add a translation to the in-process LRU cache."""
+    _translation_cache[key] = translated
+    _translation_cache.move_to_end(key)
+    if len(_translation_cache) > TRANSLATION_CACHE_SIZE:
+        _translation_cache.popitem(last=False)
+
+
+async def _load_cached(keys: list[str]) -> dict[str, str]:
+    """Look up persisted translations by cache key."""
+    try:
+        async with get_db() as db:
+            cursor = await db.execute(
+                """
+                SELECT key, translated FROM translation_cache
+                WHERE key IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(keys),),
+            )
+            rows = await cursor.fetchall()
+            if rows:
+                # Mark hits as recently used so pruning keeps them
+                await db.execute(
+                    f"""
+                    UPDATE translation_cache SET accessed_at = {SQL_UNIX_NOW}
+                    WHERE key IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps([row["key"] for row in rows]),),
+                )
+                await db.commit()
+    except Exception as e:
+        logger.warning(f"Translation cache lookup failed: {e}")
+        return {}
+
+    return {row["key"]: row["translated"] for row in rows}
+
+
+async def _store_cached(rows: list[tuple[str, str]]):
+    """Persist new translations to the cache table."""
+    if not rows:
+        return
+
+    try:
+        async with get_db() as db, write_transaction(db):
+            await db.executemany(
+                f"""
+                INSERT OR REPLACE INTO translation_cache (key, translated, accessed_at)
+                VALUES (?, ?, {SQL_UNIX_NOW})
+                """,
+                rows,
+            )
+    except Exception as e:
+        logger.warning(f"Translation cache write failed: {e}")
@@ -1,12 +1,32 @@
-import re
 from anthropic import AsyncAnthropic
-from .base import BaseLLM
+from .base import BaseLLM, SYSTEM_PROMPT, BATCH_TRANSLATION_RULES, new_http_client
 from ..config import settings
 
+# System prompt for batch calls, holding the rules that never change between
+# calls. It is far below the minimum prompt length Anthropic caches, so it is
+# not marked for prompt caching.
+BATCH_SYSTEM = f"{SYSTEM_PROMPT}\n\n{BATCH_TRANSLATION_RULES}"
+
+# Clients shared across LLM instances, keyed by API key
+_clients: dict[str, AsyncAnthropic] = {}
+
+
+def get_client(api_key: str) -> AsyncAnthropic:
+    """Return the shared client for an API key."""
+    client = _clients.get(api_key)
+    if client is None or client.is_closed():
+        client = _clients[api_key] = AsyncAnthropic(
+            api_key=api_key, http_client=new_http_client()
+        )
+    return client
+
 
 class ClaudeLLM(BaseLLM):
     """Claude LLM provider."""
 
+    provider = "claude"
+    max_concurrency = 5
+
     def __init__(
         self,
         api_key: str | None = None,
@@ -14,7 +34,7 @@ class ClaudeLLM(BaseLLM):
     ):
         self.api_key = api_key or settings.claude_api_key
         self.model = model or settings.claude_model
-        self.client = AsyncAnthropic(api_key=self.api_key)
+        self.client = get_client(self.api_key)
 
     async def translate(
         self,
@@ -31,8 +51,7 @@ class ClaudeLLM(BaseLLM):
             model=self.model,
             max_tokens=4096,
             messages=[{"role": "user", "content": prompt}],
-            system="You are a professional subtitle translator. "
-            "Translate accurately while maintaining natural flow.",
+            system=SYSTEM_PROMPT,
         )
 
         return response.content[0].text.strip()
@@ -47,38 +66,16 @@ class ClaudeLLM(BaseLLM):
         if not texts:
             return []
 
-        prompt = self._build_batch_translation_prompt(
+        header, lines = self._build_batch_prompt_parts(
             texts, source_language, target_language
         )
 
         response = await self.client.messages.create(
             model=self.model,
             max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}],
-            system="You are a professional subtitle translator. "
-            "Translate accurately while maintaining natural flow.",
+            messages=[{"role": "user", "content": f"{header}\n\n{lines}"}],
+            system=BATCH_SYSTEM,
         )
 
         result_text = response.content[0].text.strip()
         return self._parse_batch_response(result_text, len(texts))
-
-    def _parse_batch_response(
-        self, response: str, expected_count: int
-    ) -> list[str]:
-        """Parse the batch translation response."""
-        lines = response.strip().split("\n")
-        translations = []
-
-        pattern = re.compile(r"^\[(\d+)\]\s*(.*)$")
-
-        for line in lines:
-            match = pattern.match(line.strip())
-            if match:
-                translations.append(match.group(2))
-            elif line.strip() and not line.startswith("["):
-                translations.append(line.strip())
-
-        while len(translations) < expected_count:
-            translations.append("")
-
-        return translations[:expected_count]
@@ -1,12 +1,13 @@
-import re
-from openai import AsyncOpenAI
 from .base import BaseLLM
+from .openai import get_client
 from ..config import settings
 
 
 class GLMLLM(BaseLLM):
     """GLM LLM provider (OpenAI-compatible)."""
 
+    provider = "glm"
+
     def __init__(
         self,
         api_key: str | None = None,
@@ -16,12 +17,7 @@ class GLMLLM(BaseLLM):
         self.api_key = api_key or settings.glm_api_key
         self.model = model or settings.glm_model
         self.base_url = base_url or settings.glm_base_url
-
-        client_kwargs = {"api_key": self.api_key}
-        if self.base_url:
-            client_kwargs["base_url"] = self.base_url
-
-        self.client = AsyncOpenAI(**client_kwargs)
+        self.client = get_client(self.api_key, self.base_url)
 
     async def translate(
         self,
@@ -78,24 +74,3 @@ class GLMLLM(BaseLLM):
 
         result_text = response.choices[0].message.content.strip()
         return self._parse_batch_response(result_text, len(texts))
-
-    def _parse_batch_response(
-        self, response: str, expected_count: int
-    ) -> list[str]:
-        """Parse the batch translation response."""
-        lines = response.strip().split("\n")
-        translations = []
-
-        pattern = re.compile(r"^\[(\d+)\]\s*(.*)$")
-
-        for line in lines:
-            match = pattern.match(line.strip())
-            if match:
-                translations.append(match.group(2))
-            elif line.strip() and not line.startswith("["):
-                translations.append(line.strip())
-
-        while len(translations) < expected_count:
-            translations.append("")
-
-        return translations[:expected_count]
@@ -1,12 +1,53 @@
-import re
-from openai import AsyncOpenAI
-from .base import BaseLLM
+import json
+from openai import AsyncOpenAI, BadRequestError
+from .base import BaseLLM, new_http_client
 from ..config import settings
 
+# Structured output schema for batch translation: one string per input line
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "translations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "translations": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                },
+            },
+            "required": ["translations"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# (base_url, model) pairs that rejected json_schema response formats
+_NO_STRUCTURED_OUTPUT: set[tuple[str | None, str]] = set()
+
+# Clients shared across LLM instances, keyed by (api_key, base_url)
+_clients: dict[tuple[str, str | None], AsyncOpenAI] = {}
+
+
+def get_client(api_key: str, base_url: str | None = None) -> AsyncOpenAI:
+    """Return the shared client for an API key and endpoint."""
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is None or client.is_closed():
+        client_kwargs = {"api_key": api_key, "http_client": new_http_client()}
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        client = _clients[key] = AsyncOpenAI(**client_kwargs)
+    return client
+
 
 class OpenAILLM(BaseLLM):
     """OpenAI LLM provider."""
 
+    provider = "openai"
+    max_concurrency = 10
+
     def __init__(
         self,
         api_key: str | None = None,
@@ -16,12 +57,7 @@ class OpenAILLM(BaseLLM):
         self.api_key = api_key or settings.openai_api_key
         self.model = model or settings.openai_model
         self.base_url = base_url or settings.openai_base_url
-
-        client_kwargs = {"api_key": self.api_key}
-        if self.base_url:
-            client_kwargs["base_url"] = self.base_url
-
-        self.client = AsyncOpenAI(**client_kwargs)
+        self.client = get_client(self.api_key, self.base_url)
 
     async def translate(
         self,
@@ -59,6 +95,65 @@ class OpenAILLM(BaseLLM):
         if not texts:
             return []
 
+        if (self.base_url, self.model) in _NO_STRUCTURED_OUTPUT:
+            return await self._translate_batch_numbered(
+                texts, source_language, target_language
+            )
+
+        prompt = self._build_json_batch_prompt(
+            texts, source_language, target_language
+        )
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a professional subtitle translator. "
+                        "Translate accurately while maintaining natural flow.",
+                    },
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.3,
+                response_format=BATCH_RESPONSE_FORMAT,
+            )
+        except BadRequestError as e:
+            # Older models (e.g. gpt-4) don't support json_schema outputs
+            if "response_format" not in str(e):
+                raise
+            _NO_STRUCTURED_OUTPUT.add((self.base_url, self.model))
+            return await self._translate_batch_numbered(
+                texts, source_language, target_language
+            )
+
+        # A refusal comes back with no content. ValueError lets the caller
+        # retry the lines in smaller batches.
+        message = response.choices[0].message
+        if getattr(message, "refusal", None):
+            raise ValueError(f"Model refused the batch: {message.refusal}")
+        if message.content is None:
+            raise ValueError("Model returned an empty batch response")
+        try:
+            translations = [
+                str(t) for t in json.loads(message.content)["translations"]
+            ]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"Unparseable batch response: {e}") from e
+
+        # Ensure we have the expected number of translations
+        while len(translations) < len(texts):
+            translations.append("")
+
+        return translations[:len(texts)]
+
+    async def _translate_batch_numbered(
+        self,
+        texts: list[str],
+        source_language: str,
+        target_language: str,
+    ) -> list[str]:
+        """Translate a batch using the numbered-line prompt format."""
         prompt = self._build_batch_translation_prompt(
             texts, source_language, target_language
         )
@@ -79,25 +174,25 @@ class OpenAILLM(BaseLLM):
         result_text = response.choices[0].message.content.strip()
         return self._parse_batch_response(result_text, len(texts))
 
-    def _parse_batch_response(
-        self, response: str, expected_count: int
-    ) -> list[str]:
-        """Parse the batch translation response."""
-        lines = response.strip().split("\n")
-        translations = []
-
-        pattern = re.compile(r"^\[(\d+)\]\s*(.*)$")
+    def _build_json_batch_prompt(
+        self,
+        texts: list[str],
+        source_language: str,
+        target_language: str,
+    ) -> str:
+        """Build prompt for batch translation with a JSON response."""
+        source_str = (
+            f"from {source_language}" if source_language != "auto" else ""
+        )
 
-        for line in lines:
-            match = pattern.match(line.strip())
-            if match:
-                translations.append(match.group(2))
-            elif line.strip() and not line.startswith("["):
-                # Fallback: line without numbering
-                translations.append(line.strip())
+        return f"""Translate each subtitle line in the JSON array below {source_str} to {target_language}.
 
-        # Ensure we have the expected number of translations
-        while len(translations) < expected_count:
-            translations.append("")
+Rules:
+1. Keep translations natural and fluent
+2. Preserve the original meaning and tone
+3. Keep any formatting tags like {{\\an8}} or {{\\pos(x,y)}}
+4. Return exactly {len(texts)} translations in "translations", in the same order
+5. Do not add any explanations
 
-        return translations[:expected_count]
+Lines to translate:
+{json.dumps(texts, ensure_ascii=False)}"""
@@ -5,25 +5,42 @@ import os
 import shutil
 import sys
 from contextlib import asynccontextmanager
+from functools import cache
 from pathlib import Path
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from typing import Set
+from websockets.exceptions import ConnectionClosed
 
-from .database import init_db, get_db
+from .database import init_db, get_db, close_db, write_transaction
+from .routers import tasks, files, settings, watchers
+from .services.queue import task_queue
+from .services.watcher import directory_watcher
+from .services import fscache
+from .services.translator import process_mkv_translation, translate_subtitle_file
+from .llm.base import close_http_clients
+from .config import settings as app_settings, SETTING_TYPES, coerce_setting
+
+
+@cache
+def _which(name: str) -> str | None:
+    """Locate an executable on PATH, caching the result."""
+    return shutil.which(name)
 
 
 def check_system_dependencies():
     """Check if required system tools are installed."""
+    if os.environ.get("SUBAUTOTRANS_SKIP_DEPCHECK"):
+        return
+
     missing = []
 
-    if not shutil.which("ffmpeg"):
+    if not _which("ffmpeg"):
         missing.append("ffmpeg")
-    if not shutil.which("ffprobe"):
+    if not _which("ffprobe"):
         missing.append("ffprobe")
-    if not shutil.which("mkvmerge"):
+    if not _which("mkvmerge"):
         missing.append("mkvmerge (mkvtoolnix)")
 
     if missing:
@@ -39,14 +56,6 @@ def check_system_dependencies():
         sys.exit(1)
 
 
-# Check dependencies on import
-check_system_dependencies()
-from .routers import tasks, files, settings, watchers
-from .services.queue import task_queue
-from .services.watcher import directory_watcher
-from .services.translator import process_mkv_translation, translate_subtitle_file
-from .config import settings as app_settings
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -54,36 +63,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# WebSocket connections
-ws_connections: Set[WebSocket] = set()
+# Outgoing message queue and writer task per connected WebSocket client
+ws_clients: dict[WebSocket, tuple[asyncio.Queue, asyncio.Task]] = {}
 
+# Close calls for dropped clients. The loop only keeps weak references to
+# tasks, so they are held here until they finish.
+_ws_close_tasks: set[asyncio.Task] = set()
+
+# Messages buffered per client before it is considered too slow and dropped
+WS_QUEUE_SIZE = 256
+
+# Errors that mean a WebSocket client has gone away
+WS_CLOSED_ERRORS = (WebSocketDisconnect, ConnectionClosed, RuntimeError, OSError)
+
+# Minimum seconds between progress writes/broadcasts for a single task
+PROGRESS_MIN_INTERVAL = 0.2
+
+
+async def _ws_writer(websocket: WebSocket, queue: asyncio.Queue):
+    """Forward queued messages to one client, isolating slow clients."""
+    try:
+        while True:
+            message = await queue.get()
+            await websocket.send_text(message)
+    except WS_CLOSED_ERRORS:
+        ws_clients.pop(websocket, None)
 
-async def broadcast_progress(task_id: int, progress: int):
-    """Broadcast progress update to all connected WebSocket clients."""
-    message = json.dumps({"type": "progress", "task_id": task_id, "progress": progress})
 
-    disconnected = set()
-    for ws in ws_connections:
+def _drop_ws_client(websocket: WebSocket):
+    """Forget a client and stop its writer task."""
+    client = ws_clients.pop(websocket, None)
+    if client is not None:
+        client[1].cancel()
+
+
+def _broadcast(message: str):
+    """Queue a message for every connected WebSocket client."""
+    for websocket, (queue, _) in list(ws_clients.items()):
         try:
-            await ws.send_text(message)
-        except:
-            disconnected.add(ws)
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("Dropping WebSocket client that is not keeping up")
+            _drop_ws_client(websocket)
+            close_task = asyncio.create_task(websocket.close())
+            _ws_close_tasks.add(close_task)
+            close_task.add_done_callback(_ws_close_tasks.discard)
 
-    ws_connections.difference_update(disconnected)
+
+async def broadcast_progress(task_id: int, progress: int):
+    """Broadcast progress update to all connected WebSocket clients."""
+    message = json.dumps({"type": "progress", "task_id": task_id, "progress": progress})
+    _broadcast(message)
 
 
 async def broadcast_task_update(task_id: int, status: str):
     """Broadcast task status update to all connected WebSocket clients."""
     message = json.dumps({"type": "status", "task_id": task_id, "status": status})
-
-    disconnected = set()
-    for ws in ws_connections:
-        try:
-            await ws.send_text(message)
-        except:
-            disconnected.add(ws)
-
-    ws_connections.difference_update(disconnected)
+    _broadcast(message)
 
 
 async def process_task(task_id: int):
@@ -114,28 +150,11 @@ async def process_task(task_id: int):
     subtitle_track = task["subtitle_track"]
     force_override = bool(task["force_override"]) if task["force_override"] is not None else False
 
-    async def get_output_settings() -> tuple[str, bool]:
-        async with get_db() as db:
-            cursor = await db.execute(
-                "SELECT key, value FROM app_settings WHERE key IN (?, ?)",
-                ("subtitle_output_format", "overwrite_mkv"),
-            )
-            rows = await cursor.fetchall()
-            stored = {row["key"]: row["value"] for row in rows}
-
-        output_format = stored.get(
-            "subtitle_output_format", app_settings.subtitle_output_format
-        )
-        overwrite_value = stored.get("overwrite_mkv", app_settings.overwrite_mkv)
-
-        def parse_bool(value) -> bool:
-            if isinstance(value, bool):
-                return value
-            if isinstance(value, str):
-                return value.lower() in ("true", "1", "yes")
-            return bool(value)
-
-        overwrite_mkv = parse_bool(overwrite_value)
+    def get_output_settings() -> tuple[str, bool]:
+        # Runtime settings are loaded at startup and kept in sync by the
+        # settings router, so no database round-trip is needed here.
+        output_format = app_settings.subtitle_output_format
+        overwrite_mkv = app_settings.overwrite_mkv
 
         if output_format not in ("mkv", "srt", "ass"):
             output_format = "mkv"
@@ -146,10 +165,72 @@ async def process_task(task_id: int):
 
         return output_format, overwrite_mkv
 
-    async def progress_callback(progress: int):
+    loop = asyncio.get_running_loop()
+    last_progress = -1
+    last_sent_at = 0.0
+    pending_progress: int | None = None
+    flush_task: asyncio.Task | None = None
+    flushing = False
+    # Batches are translated concurrently, so callbacks can overlap
+    progress_lock = asyncio.Lock()
+
+    async def send_progress(progress: int):
+        nonlocal last_progress, last_sent_at
+        last_progress = progress
+        last_sent_at = loop.time()
         await task_queue.update_progress(task_id, progress)
         await broadcast_progress(task_id, progress)
 
+    async def flush_progress(delay: float):
+        nonlocal pending_progress, flushing
+        await asyncio.sleep(delay)
+        flushing = True
+        if pending_progress is not None:
+            progress, pending_progress = pending_progress, None
+            await send_progress(progress)
+
+    async def stop_flush():
+        # A flush still waiting is dropped; one already sending is awaited so
+        # it cannot land after a later update.
+        nonlocal flush_task, flushing
+        if flush_task is None:
+            return
+        if not flushing:
+            flush_task.cancel()
+        try:
+            await flush_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Task {task_id} progress update failed: {e}")
+        flush_task = None
+        flushing = False
+
+    async def progress_callback(progress: int):
+        async with progress_lock:
+            await update_progress(progress)
+
+    async def update_progress(progress: int):
+        # Coalesce bursts of updates; the latest value is always flushed.
+        # Progress only moves forward, whatever order callers arrive in.
+        nonlocal pending_progress, flush_task
+        if progress <= max(last_progress, pending_progress or -1):
+            return
+
+        elapsed = loop.time() - last_sent_at
+        if progress >= 100 or elapsed >= PROGRESS_MIN_INTERVAL:
+            pending_progress = None
+            await stop_flush()
+            await send_progress(progress)
+            return
+
+        pending_progress = progress
+        if flush_task is None or flush_task.done():
+            await stop_flush()
+            flush_task = asyncio.create_task(
+                flush_progress(PROGRESS_MIN_INTERVAL - elapsed)
+            )
+
     async def should_skip(output_format: str, overwrite_mkv: bool) -> bool:
         from .services import subtitle as subtitle_service
 
@@ -157,19 +238,31 @@ async def process_task(task_id: int):
         if force_override:
             return False
 
+        async with get_db() as db:
+            cursor = await db.execute(
+                """
+                SELECT 1 FROM translated_files
+                WHERE file_path = ? AND target_language = ?
+                LIMIT 1
+                """,
+                (file_path, target_language),
+            )
+            if await cursor.fetchone():
+                return True
+
         if file_ext in [".srt", ".ass"]:
             if output_format not in ["srt", "ass"]:
                 return False
             base, _ = os.path.splitext(file_path)
             lang_tag = subtitle_service.get_language_tag(target_language)
             output_path = f"{base}.{lang_tag}.{output_format}"
-            return os.path.exists(output_path)
+            return fscache.path_exists(output_path)
 
         base, ext = os.path.splitext(file_path)
         if output_format in ("srt", "ass"):
             lang_tag = subtitle_service.get_language_tag(target_language)
             output_path = f"{base}.{lang_tag}.{output_format}"
-            return os.path.exists(output_path)
+            return fscache.path_exists(output_path)
 
         lang_code = subtitle_service.get_language_code(target_language)
         info = await subtitle_service.get_subtitle_tracks(file_path)
@@ -179,12 +272,12 @@ async def process_task(task_id: int):
 
         if not overwrite_mkv:
             output_path = f"{base}.translated{ext}"
-            return os.path.exists(output_path)
+            return fscache.path_exists(output_path)
 
         return False
 
     try:
-        output_format, overwrite_mkv = await get_output_settings()
+        output_format, overwrite_mkv = get_output_settings()
         if await should_skip(output_format, overwrite_mkv):
             logger.info(
                 "Task %s skipped because target output already exists",
@@ -228,75 +321,66 @@ async def process_task(task_id: int):
                 progress_callback=progress_callback,
             )
 
+        await stop_flush()
         logger.info(f"Task {task_id} completed: {output_path}")
-        status = await get_status()
-        if status != "cancelled":
-            # Record the completed translation in database
-            async with get_db() as db:
-                await db.execute(
-                    """
-                    INSERT OR REPLACE INTO translated_files (file_path, target_language, output_path)
-                    VALUES (?, ?, ?)
-                    """,
-                    (file_path, target_language, output_path),
-                )
-                await db.commit()
+        fscache.invalidate_dir(os.path.dirname(output_path))
+        # Record the completed translation unless the task was cancelled
+        # meanwhile; the status check and insert share one statement.
+        async with get_db() as db, write_transaction(db):
+            cursor = await db.execute(
+                """
+                INSERT OR REPLACE INTO translated_files (file_path, target_language, output_path)
+                SELECT ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM tasks WHERE id = ? AND status != ?)
+                """,
+                (file_path, target_language, output_path, task_id, "cancelled"),
+            )
+        if cursor.rowcount > 0:
             await broadcast_task_update(task_id, "completed")
 
     except Exception as e:
         logger.error(f"Task {task_id} failed: {e}")
+        await stop_flush()
         status = await get_status()
         if status != "cancelled":
             await broadcast_task_update(task_id, "failed")
             raise
 
+    finally:
+        if flush_task is not None:
+            flush_task.cancel()
+
 
 async def check_file_should_skip(db, file_path: str, target_language: str) -> tuple[bool, str]:
     """Check if a file should be skipped for translation."""
-    from .models.task import TaskStatus
-    from .services import subtitle as subtitle_service
-
-    # 1. Check if there's already a pending/processing task
+    # 1. Check for a pending/processing task or a recorded translation.
+    # The task id is the rowid, so idx_tasks_active covers this lookup.
     cursor = await db.execute(
         """
-        SELECT id, status FROM tasks
-        WHERE file_path = ? AND target_language = ? AND status IN (?, ?)
+        SELECT
+            (SELECT id FROM tasks
+             WHERE file_path = ? AND target_language = ?
+               AND status IN ('pending', 'processing')
+             LIMIT 1) AS task_id,
+            EXISTS (SELECT 1 FROM translated_files
+                    WHERE file_path = ? AND target_language = ?) AS translated
         """,
-        (file_path, target_language, TaskStatus.PENDING.value, TaskStatus.PROCESSING.value),
-    )
-    existing_task = await cursor.fetchone()
-    if existing_task:
-        return True, f"Task exists (id={existing_task['id']})"
-
-    # 2. Check if already translated in database
-    cursor = await db.execute(
-        "SELECT id FROM translated_files WHERE file_path = ? AND target_language = ?",
-        (file_path, target_language),
+        (file_path, target_language, file_path, target_language),
     )
-    if await cursor.fetchone():
+    row = await cursor.fetchone()
+    if row["task_id"] is not None:
+        return True, f"Task exists (id={row['task_id']})"
+    if row["translated"]:
         return True, "Already translated"
 
-    # 3. For MKV, check if target language subtitle track exists
-    if file_path.lower().endswith(".mkv"):
-        try:
-            lang_code = subtitle_service.get_language_code(target_language)
-            info = await subtitle_service.get_subtitle_tracks(file_path)
-            for track in info.tracks:
-                if track.language and track.language.lower() == lang_code:
-                    return True, f"MKV has {target_language} track"
-        except Exception:
-            pass
-
-    # 4. Check if output file exists
-    base, ext = os.path.splitext(file_path)
-    lang_tag = subtitle_service.get_language_tag(target_language)
-    for fmt in ["srt", "ass"]:
-        if os.path.exists(f"{base}.{lang_tag}.{fmt}"):
-            return True, "Output file exists"
-    if os.path.exists(f"{base}.translated{ext}"):
-        return True, "Translated file exists"
+    from .services import subtitle as subtitle_service
 
-    return False, ""
+    return await tasks.check_existing_outputs(
+        file_path,
+        target_language,
+        subtitle_service.get_language_code(target_language),
+        subtitle_service.get_language_tag(target_language),
+    )
 
 
 async def on_new_file_detected(
@@ -312,25 +396,67 @@ async def on_new_file_detected(
             logger.debug(f"Skipped {file_path}: {reason}")
             return
 
-        cursor = await db.execute(
+        async with write_transaction(db):
+            cursor = await db.execute(
+                """
+                INSERT INTO tasks (file_path, file_name, target_language, llm_provider)
+                VALUES (?, ?, ?, ?)
+                """,
+                (file_path, file_name, target_language, llm_provider),
+            )
+
+        task_id = cursor.lastrowid
+        task_queue.notify()
+        logger.info(f"Auto-created task {task_id} for {file_path}")
+
+        # Broadcast new task
+        message = json.dumps({"type": "new_task", "task_id": task_id})
+        _broadcast(message)
+
+
+async def on_new_files_detected_batch(
+    file_paths: list[str], target_language: str, llm_provider: str
+) -> int:
+    """Handler for batches of files found by a directory scan.
+
+    Returns the number of tasks created.
+    """
+    # Task and translation lookups share one connection; the ffprobe checks
+    # run concurrently after it is released
+    skipped = await tasks.check_files_should_skip_bulk(file_paths, target_language)
+
+    rows = []
+    for file_path in file_paths:
+        reason = skipped.get(file_path)
+        if reason:
+            logger.debug(f"Skipped {file_path}: {reason}")
+            continue
+
+        rows.append(
+            (file_path, os.path.basename(file_path), target_language, llm_provider)
+        )
+
+    if not rows:
+        return 0
+
+    async with get_db() as db, write_transaction(db):
+        await db.executemany(
             """
             INSERT INTO tasks (file_path, file_name, target_language, llm_provider)
             VALUES (?, ?, ?, ?)
             """,
-            (file_path, file_name, target_language, llm_provider),
+            rows,
         )
-        await db.commit()
+        cursor = await db.execute("SELECT last_insert_rowid()")
+        last_task_id = (await cursor.fetchone())[0]
 
-        task_id = cursor.lastrowid
-        logger.info(f"Auto-created task {task_id} for {file_path}")
+    task_queue.notify()
+    logger.info(f"Auto-created {len(rows)} tasks for {target_language}")
 
-        # Broadcast new task
-        message = json.dumps({"type": "new_task", "task_id": task_id})
-        for ws in ws_connections:
-            try:
-                await ws.send_text(message)
-            except:
-                pass
+    # Broadcast once for the whole batch; clients refetch the task list
+    message = json.dumps({"type": "new_task", "task_id": last_task_id})
+    _broadcast(message)
+    return len(rows)
 
 
 async def init_watchers(scan_existing: bool = True):
@@ -372,16 +498,9 @@ async def load_settings_from_db():
         cursor = await db.execute("SELECT key, value FROM app_settings")
         rows = await cursor.fetchall()
 
-        for row in rows:
-            key, value = row["key"], row["value"]
-            if hasattr(app_settings, key):
-                current_type = type(getattr(app_settings, key))
-                if current_type == bool:
-                    setattr(app_settings, key, value.lower() in ("true", "1", "yes") if isinstance(value, str) else bool(value))
-                elif current_type == int:
-                    setattr(app_settings, key, int(value))
-                else:
-                    setattr(app_settings, key, value)
+        for key, value in rows:
+            if key in SETTING_TYPES:
+                setattr(app_settings, key, coerce_setting(key, value))
 
         logger.info("Loaded settings from database")
 
@@ -392,6 +511,11 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting SubAutoTrans...")
 
+    check_system_dependencies()
+
+    # Ensure directories exist
+    os.makedirs(app_settings.temp_dir, exist_ok=True)
+
     # Initialize database
     await init_db()
 
@@ -405,6 +529,7 @@ async def lifespan(app: FastAPI):
 
     # Configure directory watcher
     directory_watcher.set_new_file_callback(on_new_file_detected)
+    directory_watcher.set_new_files_batch_callback(on_new_files_detected_batch)
     await init_watchers()
 
     logger.info("SubAutoTrans started successfully")
@@ -415,6 +540,9 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down SubAutoTrans...")
     await task_queue.stop()
     directory_watcher.stop_all()
+    await close_http_clients()
+    await settings.close_test_clients()
+    await close_db()
     logger.info("SubAutoTrans stopped")
 
 
@@ -462,16 +590,18 @@ async def health():
 async def websocket_progress(websocket: WebSocket):
     """WebSocket endpoint for real-time progress updates."""
     await websocket.accept()
-    ws_connections.add(websocket)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+    writer = asyncio.create_task(_ws_writer(websocket, queue))
+    ws_clients[websocket] = (queue, writer)
 
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
-    except WebSocketDisconnect:
-        ws_connections.discard(websocket)
-    except Exception:
-        ws_connections.discard(websocket)
+    except WS_CLOSED_ERRORS:
+        pass
+    finally:
+        _drop_ws_client(websocket)
 
 
 # Serve frontend static files (for Docker deployment)
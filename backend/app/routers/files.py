@@ -1,11 +1,23 @@
+import asyncio
+import io
 import os
-import aiofiles
+import stat
 from fastapi import APIRouter, HTTPException, UploadFile, File, Query
 from typing import Optional
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/files", tags=["files"])
 
+# File types shown when browsing and accepted for upload
+ALLOWED_EXTENSIONS = (".mkv", ".srt", ".ass")
+
+# Current user's home directory, resolved once for "~" paths
+HOME_DIR = os.path.expanduser("~")
+
+# Read/write size when copying uploaded files to their destination
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+SENDFILE_CHUNK_SIZE = 16 * 1024 * 1024
+
 
 class FileInfo(BaseModel):
     name: str
@@ -26,68 +38,85 @@ async def browse_files(
 ):
     """Browse server file system."""
     # Expand user home directory
-    if path.startswith("~"):
+    if path == "~" or path.startswith("~/"):
+        path = HOME_DIR + path[1:]
+    elif path.startswith("~"):
         path = os.path.expanduser(path)
 
     path = os.path.abspath(path)
 
-    if not os.path.exists(path):
+    # Directory reads may hit network shares, so keep them off the event loop
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except OSError:
         raise HTTPException(status_code=404, detail="Path not found")
 
-    if not os.path.isdir(path):
+    if not stat.S_ISDIR(st.st_mode):
         raise HTTPException(status_code=400, detail="Path is not a directory")
 
-    items = []
-
     try:
-        for name in sorted(os.listdir(path)):
-            full_path = os.path.join(path, name)
-
-            # Skip hidden files
-            if name.startswith("."):
-                continue
-
-            try:
-                is_dir = os.path.isdir(full_path)
-                size = None if is_dir else os.path.getsize(full_path)
-
-                # Only show directories and supported subtitle files
-                if is_dir or name.lower().endswith((".mkv", ".srt", ".ass")):
-                    items.append(
-                        FileInfo(
-                            name=name,
-                            path=full_path,
-                            is_dir=is_dir,
-                            size=size,
-                        )
-                    )
-            except (PermissionError, OSError):
-                continue
-
+        items = await asyncio.to_thread(_scan_dir, path)
     except PermissionError:
         raise HTTPException(
             status_code=403, detail="Permission denied to read directory"
         )
 
-    # Sort: directories first, then files
-    items.sort(key=lambda x: (not x.is_dir, x.name.lower()))
-
     parent_path = os.path.dirname(path) if path != "/" else None
 
-    return BrowseResponse(
+    return BrowseResponse.model_construct(
         current_path=path,
         parent_path=parent_path,
         items=items,
     )
 
 
+def _scan_dir(path: str) -> list[FileInfo]:
+    """List the subdirectories and supported files in a directory."""
+    # (not is_dir, lowercase name, name, item): directories first, then files.
+    # Names are unique within a directory, so the item is never compared.
+    entries = []
+
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+
+            # Skip hidden files
+            if name.startswith("."):
+                continue
+
+            lower_name = name.lower()
+            try:
+                is_dir = entry.is_dir()
+
+                # Only show directories and supported subtitle files
+                if is_dir:
+                    size = None
+                elif lower_name.endswith(ALLOWED_EXTENSIONS):
+                    size = entry.stat().st_size
+                else:
+                    continue
+
+                item = FileInfo.model_construct(
+                    name=name,
+                    path=entry.path,
+                    is_dir=is_dir,
+                    size=size,
+                )
+            except OSError:
+                continue
+            entries.append((not is_dir, lower_name, name, item))
+
+    entries.sort()
+    return [entry[3] for entry in entries]
+
+
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
     destination: str = Query(default="./data/uploads"),
 ):
     """Upload an MKV file to the server."""
-    if not file.filename.lower().endswith((".mkv", ".srt", ".ass")):
+    if not file.filename.lower().endswith(ALLOWED_EXTENSIONS):
         raise HTTPException(
             status_code=400, detail="Only MKV, SRT, or ASS files are allowed"
         )
@@ -95,27 +124,70 @@ async def upload_file(
     # Ensure destination directory exists
     os.makedirs(destination, exist_ok=True)
 
-    file_path = os.path.join(destination, file.filename)
-
-    # Avoid overwriting existing files
-    if os.path.exists(file_path):
-        base, ext = os.path.splitext(file.filename)
-        counter = 1
-        while os.path.exists(file_path):
-            file_path = os.path.join(destination, f"{base}_{counter}{ext}")
-            counter += 1
-
-    async with aiofiles.open(file_path, "wb") as f:
-        while chunk := await file.read(1024 * 1024):  # 1MB chunks
-            await f.write(chunk)
+    # Avoid overwriting existing files. The name is claimed with O_EXCL so
+    # concurrent uploads of the same file can't pick the same path.
+    name = file.filename
+    base, ext = os.path.splitext(name)
+    existing = set(os.listdir(destination))
+    counter = 1
+    while True:
+        if name not in existing:
+            file_path = os.path.join(destination, name)
+            try:
+                fd = os.open(
+                    file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644
+                )
+                break
+            except FileExistsError:
+                pass
+        name = f"{base}_{counter}{ext}"
+        counter += 1
+
+    await file.seek(0)
+    size = await asyncio.to_thread(_copy_upload, file.file, fd)
 
     return {
-        "filename": os.path.basename(file_path),
+        "filename": name,
         "path": file_path,
-        "size": os.path.getsize(file_path),
+        "size": size,
     }
 
 
+def _copy_upload(src, fd: int) -> int:
+    """Copy an uploaded file's spooled contents to an open descriptor.
+
+    Returns the number of bytes written.
+    """
+    with os.fdopen(fd, "wb") as dst:
+        size = _sendfile(src, dst)
+        if size is not None:
+            return size
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+        size = 0
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            dst.write(chunk)
+            size += len(chunk)
+        return size
+
+
+def _sendfile(src, dst) -> int | None:
+    """Copy src to dst in the kernel. Returns None if that isn't possible."""
+    # Uploads still spooled in memory have no descriptor to send from
+    if not hasattr(os, "sendfile") or not getattr(src, "_rolled", True):
+        return None
+    size = 0
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        while sent := os.sendfile(dst_fd, src_fd, None, SENDFILE_CHUNK_SIZE):
+            size += sent
+    except (OSError, io.UnsupportedOperation):
+        return None
+    return size
+
+
 @router.get("/subtitle-tracks")
 async def get_subtitle_tracks(file_path: str):
     """Get subtitle tracks from an MKV file."""
@@ -1,15 +1,75 @@
+import asyncio
+from collections import OrderedDict
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from ..database import get_db
+from ..database import get_db, write_transaction
 from ..services.queue import task_queue
-from ..config import settings
-from openai import AsyncOpenAI
-from anthropic import AsyncAnthropic
+from ..config import settings, SETTING_TYPES, TRUTHY_STRINGS, coerce_setting
 import json
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
 
+UPSERT_SETTING_SQL = """
+    INSERT INTO app_settings (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+"""
+
+# Static payloads, built once at import
+LLM_PROVIDERS_RESPONSE = {
+    "providers": [
+        {
+            "id": "openai",
+            "name": "OpenAI",
+            "models": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+        },
+        {
+            "id": "claude",
+            "name": "Claude",
+            "models": [
+                "claude-3-opus-20240229",
+                "claude-3-sonnet-20240229",
+                "claude-3-haiku-20240307",
+            ],
+        },
+        {
+            "id": "deepseek",
+            "name": "DeepSeek",
+            "models": ["deepseek-chat", "DeepSeek-V3.2", "deepseek-reasoner"],
+        },
+        {
+            "id": "glm",
+            "name": "GLM",
+            "models": ["glm-4.6"],
+        },
+    ]
+}
+
+LANGUAGES_RESPONSE = {
+    "languages": [
+        {"code": "Chinese", "name": "Chinese (Simplified)"},
+        {"code": "English", "name": "English"},
+        {"code": "Japanese", "name": "Japanese"},
+        {"code": "Korean", "name": "Korean"},
+        {"code": "French", "name": "French"},
+        {"code": "German", "name": "German"},
+        {"code": "Spanish", "name": "Spanish"},
+        {"code": "Russian", "name": "Russian"},
+        {"code": "Portuguese", "name": "Portuguese"},
+        {"code": "Italian", "name": "Italian"},
+    ]
+}
+
+# Copy of the app_settings rows, loaded on first read and replaced on write
+_settings_cache: dict[str, str] | None = None
+_settings_cache_lock = asyncio.Lock()
+
+# SDK clients kept for connection tests, keyed by (provider, api_key,
+# base_url). Tested keys are often mistyped or replaced, so only the most
+# recently used few are kept and evicted clients are closed.
+MAX_TEST_CLIENTS = 4
+_test_clients: OrderedDict[tuple[str, str, Optional[str]], object] = OrderedDict()
+
 
 class AppSettings(BaseModel):
     # LLM settings
@@ -35,6 +95,8 @@ class AppSettings(BaseModel):
 
     # Queue settings
     max_concurrent_tasks: int = 2
+    llm_rpm_limit: int = 0
+    llm_tpm_limit: int = 0
 
 
 class SettingsUpdate(BaseModel):
@@ -56,6 +118,8 @@ class SettingsUpdate(BaseModel):
     subtitle_output_format: Optional[str] = None
     overwrite_mkv: Optional[bool] = None
     max_concurrent_tasks: Optional[int] = None
+    llm_rpm_limit: Optional[int] = None
+    llm_tpm_limit: Optional[int] = None
 
 
 class LLMTestRequest(BaseModel):
@@ -65,141 +129,110 @@ class LLMTestRequest(BaseModel):
     base_url: Optional[str] = None
 
 
+# Field groups of AppSettings, used to merge stored values with the defaults
+_APP_SETTINGS_FIELDS = tuple(AppSettings.model_fields)
+_MASKED_FIELDS = tuple(f for f in _APP_SETTINGS_FIELDS if f.endswith("_api_key"))
+_BOOL_FIELDS = ("bilingual_output", "overwrite_mkv")
+_INT_FIELDS = ("max_concurrent_tasks", "llm_rpm_limit", "llm_tpm_limit")
+
+
 @router.get("", response_model=AppSettings)
 async def get_settings():
     """Get application settings."""
-    async with get_db() as db:
-        cursor = await db.execute("SELECT key, value FROM app_settings")
-        rows = await cursor.fetchall()
-
-        stored_settings = {row["key"]: row["value"] for row in rows}
-
-    # Merge with defaults from config
-    return AppSettings(
-        openai_api_key=_mask_key(
-            stored_settings.get("openai_api_key", settings.openai_api_key)
-        ),
-        openai_model=stored_settings.get("openai_model", settings.openai_model),
-        openai_base_url=stored_settings.get(
-            "openai_base_url", settings.openai_base_url
-        ),
-        claude_api_key=_mask_key(
-            stored_settings.get("claude_api_key", settings.claude_api_key)
-        ),
-        claude_model=stored_settings.get("claude_model", settings.claude_model),
-        deepseek_api_key=_mask_key(
-            stored_settings.get("deepseek_api_key", settings.deepseek_api_key)
-        ),
-        deepseek_model=stored_settings.get(
-            "deepseek_model", settings.deepseek_model
-        ),
-        deepseek_base_url=stored_settings.get(
-            "deepseek_base_url", settings.deepseek_base_url
-        ),
-        glm_api_key=_mask_key(
-            stored_settings.get("glm_api_key", settings.glm_api_key)
-        ),
-        glm_model=stored_settings.get("glm_model", settings.glm_model),
-        glm_base_url=stored_settings.get(
-            "glm_base_url", settings.glm_base_url
-        ),
-        default_llm=stored_settings.get("default_llm", settings.default_llm),
-        target_language=stored_settings.get(
-            "target_language", settings.target_language
-        ),
-        source_language=stored_settings.get(
-            "source_language", settings.source_language
-        ),
-        bilingual_output=_parse_bool(
-            stored_settings.get("bilingual_output", settings.bilingual_output)
-        ),
-        subtitle_output_format=stored_settings.get(
-            "subtitle_output_format", settings.subtitle_output_format
-        ),
-        overwrite_mkv=_parse_bool(
-            stored_settings.get("overwrite_mkv", settings.overwrite_mkv)
-        ),
-        max_concurrent_tasks=int(
-            stored_settings.get(
-                "max_concurrent_tasks", settings.max_concurrent_tasks
-            )
-        ),
+    return _build_app_settings(await _load_settings())
+
+
+async def _load_settings() -> dict[str, str]:
+    """Return the stored settings rows, reading the database only once."""
+    global _settings_cache
+    if _settings_cache is None:
+        async with _settings_cache_lock:
+            if _settings_cache is None:
+                async with get_db() as db:
+                    cursor = await db.execute(
+                        "SELECT key, value FROM app_settings"
+                    )
+                    rows = await cursor.fetchall()
+                # Rows are (key, value) pairs, so dict() takes them directly
+                _settings_cache = dict(rows)
+    return _settings_cache
+
+
+def _build_app_settings(stored_settings: dict[str, str]) -> AppSettings:
+    """Merge stored settings with defaults from config."""
+    merged = {field: getattr(settings, field) for field in _APP_SETTINGS_FIELDS}
+    merged.update(
+        (key, value) for key, value in stored_settings.items() if key in merged
     )
 
+    for field in _MASKED_FIELDS:
+        merged[field] = _mask_key(merged[field])
+    for field in _BOOL_FIELDS:
+        merged[field] = _parse_bool(merged[field])
+    for field in _INT_FIELDS:
+        merged[field] = int(merged[field])
+
+    # Values are already coerced above, so skip validation
+    return AppSettings.model_construct(**merged)
+
 
 @router.put("", response_model=AppSettings)
 async def update_settings(update: SettingsUpdate):
     """Update application settings."""
-    async with get_db() as db:
-        for key, value in update.model_dump(exclude_none=True).items():
-            # Don't store if value is masked
-            if key.endswith("_api_key") and isinstance(value, str):
-                if value == "***" or "..." in value:
-                    continue
-
-            str_value = str(value) if not isinstance(value, str) else value
-
-            await db.execute(
-                """
-                INSERT INTO app_settings (key, value) VALUES (?, ?)
-                ON CONFLICT(key) DO UPDATE SET value = ?
-                """,
-                (key, str_value, str_value),
+    rows = []
+    for key, value in update.model_dump(exclude_none=True).items():
+        # Don't store if value is masked
+        if key.endswith("_api_key") and isinstance(value, str):
+            if value == "***" or "..." in value:
+                continue
+
+        rows.append((key, value if isinstance(value, str) else str(value)))
+
+    global _settings_cache
+    # Holding the cache lock keeps a concurrent first read from caching
+    # rows older than this write
+    async with _settings_cache_lock:
+        async with get_db() as db, write_transaction(db):
+            if rows:
+                await db.executemany(UPSERT_SETTING_SQL, rows)
+
+            cursor = await db.execute("SELECT key, value FROM app_settings")
+            stored = dict(await cursor.fetchall())
+
+            output_format, overwrite_mkv = _normalize_output_settings(stored)
+            stored["subtitle_output_format"] = output_format
+            stored["overwrite_mkv"] = str(overwrite_mkv)
+            await db.executemany(
+                UPSERT_SETTING_SQL,
+                [
+                    ("subtitle_output_format", output_format),
+                    ("overwrite_mkv", str(overwrite_mkv)),
+                ],
             )
 
-        await db.commit()
+        _settings_cache = stored
 
-    # Update runtime settings
-    await _update_runtime_settings()
-    task_queue.set_max_concurrent(settings.max_concurrent_tasks)
-    await _normalize_output_settings()
+    # Update runtime settings; other keys were applied when they were saved
+    changed = dict(rows)
+    changed["subtitle_output_format"] = output_format
+    changed["overwrite_mkv"] = str(overwrite_mkv)
+    _update_runtime_settings(changed)
+    if settings.max_concurrent_tasks != task_queue.max_concurrent:
+        task_queue.set_max_concurrent(settings.max_concurrent_tasks)
 
-    return await get_settings()
+    return _build_app_settings(stored)
 
 
 @router.get("/llm-providers")
 async def get_llm_providers():
     """Get available LLM providers."""
-    return {
-        "providers": [
-            {
-                "id": "openai",
-                "name": "OpenAI",
-                "models": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
-            },
-            {
-                "id": "claude",
-                "name": "Claude",
-                "models": [
-                    "claude-3-opus-20240229",
-                    "claude-3-sonnet-20240229",
-                    "claude-3-haiku-20240307",
-                ],
-            },
-            {
-                "id": "deepseek",
-                "name": "DeepSeek",
-                "models": ["deepseek-chat", "DeepSeek-V3.2", "deepseek-reasoner"],
-            },
-            {
-                "id": "glm",
-                "name": "GLM",
-                "models": ["glm-4.6"],
-            },
-        ]
-    }
+    return LLM_PROVIDERS_RESPONSE
 
 
 @router.post("/test-llm")
 async def test_llm_connection(request: LLMTestRequest):
     """Test LLM provider connection with a lightweight prompt."""
-    async with get_db() as db:
-        cursor = await db.execute("SELECT key, value FROM app_settings")
-        rows = await cursor.fetchall()
-        stored_settings = {row["key"]: row["value"] for row in rows}
-
-    def _is_masked(value: Optional[str]) -> bool:
-        return not value or value == "***" or "..." in value
+    stored_settings = await _load_settings()
 
     def _resolve(value: Optional[str], key: str, default: Optional[str]):
         if _is_masked(value):
@@ -239,8 +272,8 @@ async def test_llm_connection(request: LLMTestRequest):
         raise HTTPException(status_code=400, detail="API key is required")
 
     try:
+        client = await _get_test_client(provider, api_key, base_url)
         if provider == "claude":
-            client = AsyncAnthropic(api_key=api_key)
             response = await client.messages.create(
                 model=model,
                 max_tokens=8,
@@ -250,10 +283,6 @@ async def test_llm_connection(request: LLMTestRequest):
             if not response.content:
                 raise RuntimeError("Empty response from Claude")
         else:
-            client_kwargs = {"api_key": api_key}
-            if base_url:
-                client_kwargs["base_url"] = base_url
-            client = AsyncOpenAI(**client_kwargs)
             response = await client.chat.completions.create(
                 model=model,
                 messages=[
@@ -274,20 +303,7 @@ async def test_llm_connection(request: LLMTestRequest):
 @router.get("/languages")
 async def get_languages():
     """Get available languages."""
-    return {
-        "languages": [
-            {"code": "Chinese", "name": "Chinese (Simplified)"},
-            {"code": "English", "name": "English"},
-            {"code": "Japanese", "name": "Japanese"},
-            {"code": "Korean", "name": "Korean"},
-            {"code": "French", "name": "French"},
-            {"code": "German", "name": "German"},
-            {"code": "Spanish", "name": "Spanish"},
-            {"code": "Russian", "name": "Russian"},
-            {"code": "Portuguese", "name": "Portuguese"},
-            {"code": "Italian", "name": "Italian"},
-        ]
-    }
+    return LANGUAGES_RESPONSE
 
 
 def _mask_key(key: Optional[str]) -> Optional[str]:
@@ -299,48 +315,67 @@ def _mask_key(key: Optional[str]) -> Optional[str]:
     return f"{key[:3]}...{key[-4:]}"
 
 
+def _is_masked(value: Optional[str]) -> bool:
+    """Check whether a submitted key is empty or a masked placeholder."""
+    return not value or value == "***" or "..." in value
+
+
 def _parse_bool(value) -> bool:
     """Parse boolean from various types."""
     if isinstance(value, bool):
         return value
     if isinstance(value, str):
-        return value.lower() in ("true", "1", "yes")
+        return value.lower() in TRUTHY_STRINGS
     return bool(value)
 
 
-async def _update_runtime_settings():
-    """Update runtime settings from database."""
-    async with get_db() as db:
-        cursor = await db.execute("SELECT key, value FROM app_settings")
-        rows = await cursor.fetchall()
+async def _get_test_client(provider: str, api_key: str, base_url: Optional[str]):
+    """Return a cached SDK client for connection tests, creating it if needed."""
+    key = (provider, api_key, base_url)
+    client = _test_clients.get(key)
+    if client is not None and not client.is_closed():
+        _test_clients.move_to_end(key)
+        return client
 
-        for row in rows:
-            key, value = row["key"], row["value"]
+    if provider == "claude":
+        from anthropic import AsyncAnthropic
 
-            if hasattr(settings, key):
-                current_type = type(getattr(settings, key))
-                if current_type == bool:
-                    setattr(settings, key, _parse_bool(value))
-                elif current_type == int:
-                    setattr(settings, key, int(value))
-                else:
-                    setattr(settings, key, value)
+        client = AsyncAnthropic(api_key=api_key)
+    else:
+        from openai import AsyncOpenAI
 
+        client_kwargs = {"api_key": api_key}
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        client = AsyncOpenAI(**client_kwargs)
+
+    _test_clients[key] = client
+    while len(_test_clients) > MAX_TEST_CLIENTS:
+        _, evicted = _test_clients.popitem(last=False)
+        await evicted.close()
+    return client
+
+
+async def close_test_clients():
+    """Close the clients kept for connection tests."""
+    while _test_clients:
+        _, client = _test_clients.popitem()
+        await client.close()
 
-async def _normalize_output_settings():
-    """Keep output settings mutually exclusive and persist adjustments."""
-    async with get_db() as db:
-        cursor = await db.execute(
-            "SELECT key, value FROM app_settings WHERE key IN (?, ?)",
-            ("subtitle_output_format", "overwrite_mkv"),
-        )
-        rows = await cursor.fetchall()
-        stored = {row["key"]: row["value"] for row in rows}
 
-    output_format = stored.get("subtitle_output_format", settings.subtitle_output_format)
-    overwrite_mkv = _parse_bool(
-        stored.get("overwrite_mkv", settings.overwrite_mkv)
+def _update_runtime_settings(changed: dict[str, str]):
+    """Apply changed stored values to the runtime settings."""
+    for key, value in changed.items():
+        if key in SETTING_TYPES:
+            setattr(settings, key, coerce_setting(key, value))
+
+
+def _normalize_output_settings(stored: dict[str, str]) -> tuple[str, bool]:
+    """Return output format and overwrite flag made mutually exclusive."""
+    output_format = stored.get(
+        "subtitle_output_format", settings.subtitle_output_format
     )
+    overwrite_mkv = _parse_bool(stored.get("overwrite_mkv", settings.overwrite_mkv))
 
     if output_format not in ("mkv", "srt", "ass"):
         output_format = "mkv"
@@ -350,22 +385,4 @@ async def _normalize_output_settings():
     elif output_format in ("srt", "ass"):
         overwrite_mkv = False
 
-    async with get_db() as db:
-        await db.execute(
-            """
-            INSERT INTO app_settings (key, value) VALUES (?, ?)
-            ON CONFLICT(key) DO UPDATE SET value = ?
-            """,
-            ("subtitle_output_format", output_format, output_format),
-        )
-        await db.execute(
-            """
-            INSERT INTO app_settings (key, value) VALUES (?, ?)
-            ON CONFLICT(key) DO UPDATE SET value = ?
-            """,
-            ("overwrite_mkv", str(overwrite_mkv), str(overwrite_mkv)),
-        )
-        await db.commit()
-
-    settings.subtitle_output_format = output_format
-    settings.overwrite_mkv = overwrite_mkv
+    return output_format, overwrite_mkv
@@ -1,9 +1,12 @@
+import asyncio
+import json
 import os
+import stat
 import logging
 from fastapi import APIRouter, HTTPException
-from typing import Optional
+from typing import Iterator, Optional
 from datetime import datetime
-from ..database import get_db
+from ..database import SQL_NOW, get_db, write_transaction
 from ..models.task import (
     TaskCreate,
     TaskResponse,
@@ -12,12 +15,25 @@ from ..models.task import (
     TaskIdList,
     TaskListResponse,
 )
-from ..services import subtitle as subtitle_service
+from ..services import fscache, subtitle as subtitle_service
+from ..services.queue import task_queue
+from ..services.watcher import is_generated_subtitle
 from ..config import settings as app_settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
 
+# Files checked at once when creating tasks for a directory
+PROBE_CONCURRENCY = 8
+
+# Moves the tasks in a JSON array of ids from one status to another. The id
+# list is a single parameter, so the SQL text (and the prepared statement
+# sqlite3 caches for it) is the same however many tasks are selected.
+_SQL_SET_STATUS_FOR_IDS = f"""
+    UPDATE tasks SET status = ?, updated_at = {SQL_NOW}
+    WHERE id IN (SELECT value FROM json_each(?)) AND status = ?
+"""
+
 
 async def check_file_should_skip(
     db, file_path: str, target_language: str, force_override: bool = False
@@ -30,16 +46,19 @@ async def check_file_should_skip(
     # Skip all other checks (existing translations, subtitle tracks, output files)
 
     # 1. Check if there's already a pending/processing task for this file+language
+    # (literal statuses so the partial idx_tasks_active index is used)
     cursor = await db.execute(
         """
-        SELECT id, status FROM tasks
-        WHERE file_path = ? AND target_language = ? AND status IN (?, ?)
+        SELECT id FROM tasks
+        WHERE file_path = ? AND target_language = ?
+          AND status IN ('pending', 'processing')
+        LIMIT 1
         """,
-        (file_path, target_language, TaskStatus.PENDING.value, TaskStatus.PROCESSING.value),
+        (file_path, target_language),
     )
     existing_task = await cursor.fetchone()
     if existing_task:
-        return True, f"Task already exists (id={existing_task['id']}, status={existing_task['status']})"
+        return True, f"Task already exists (id={existing_task['id']})"
 
     # If force_override is True, skip all remaining checks
     if force_override:
@@ -48,17 +67,98 @@ async def check_file_should_skip(
     # 2. Check if file is already marked as translated in database
     cursor = await db.execute(
         """
-        SELECT id FROM translated_files WHERE file_path = ? AND target_language = ?
+        SELECT 1 FROM translated_files WHERE file_path = ? AND target_language = ? LIMIT 1
         """,
         (file_path, target_language),
     )
     if await cursor.fetchone():
         return True, "Already translated (recorded in database)"
 
-    # 3. For MKV files, check if target language subtitle track already exists
-    if file_path.lower().endswith(".mkv"):
+    return await check_existing_outputs(
+        file_path,
+        target_language,
+        subtitle_service.get_language_code(target_language),
+        subtitle_service.get_language_tag(target_language),
+    )
+
+
+async def check_files_should_skip_bulk(
+    file_paths: list[str], target_language: str, force_override: bool = False
+) -> dict[str, str]:
+    """
+    Check many files at once for skipping.
+    Returns {file_path: reason} for the files that should be skipped.
+
+    The database connection is released before the files are probed.
+    """
+    skipped: dict[str, str] = {}
+    paths_json = json.dumps(file_paths)
+
+    async with get_db() as db:
+        cursor = await db.execute(
+            """
+            SELECT file_path, MIN(id) AS id FROM tasks
+            WHERE target_language = ? AND status IN ('pending', 'processing')
+              AND file_path IN (SELECT value FROM json_each(?))
+            GROUP BY file_path
+            """,
+            (target_language, paths_json),
+        )
+        for row in await cursor.fetchall():
+            skipped[row["file_path"]] = f"Task already exists (id={row['id']})"
+
+        if force_override:
+            return skipped
+
+        cursor = await db.execute(
+            """
+            SELECT file_path FROM translated_files
+            WHERE target_language = ?
+              AND file_path IN (SELECT value FROM json_each(?))
+            """,
+            (target_language, paths_json),
+        )
+        for row in await cursor.fetchall():
+            skipped.setdefault(
+                row["file_path"], "Already translated (recorded in database)"
+            )
+
+    # MKV checks run ffprobe, so probe several files at a time
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    lang_code = subtitle_service.get_language_code(target_language)
+    lang_tag = subtitle_service.get_language_tag(target_language)
+
+    async def probe(file_path: str) -> tuple[bool, str]:
+        async with semaphore:
+            return await check_existing_outputs(
+                file_path, target_language, lang_code, lang_tag
+            )
+
+    remaining = [file_path for file_path in file_paths if file_path not in skipped]
+    results = await asyncio.gather(*(probe(file_path) for file_path in remaining))
+    for file_path, (should_skip, reason) in zip(remaining, results):
+        if should_skip:
+            skipped[file_path] = reason
+
+    return skipped
+
+
+async def check_existing_outputs(
+    file_path: str, target_language: str, lang_code: str, lang_tag: str
+) -> tuple[bool, str]:
+    """Check for an existing output file or target subtitle track."""
+    base, ext = os.path.splitext(file_path)
+
+    # 3. Check if output file already exists. Listing the directory can
+    # block on network shares, so it runs in a worker thread.
+    found, reason = await asyncio.to_thread(_find_existing_output, base, ext, lang_tag)
+    if found:
+        return found, reason
+
+    # 4. For MKV files, check if target language subtitle track already
+    # exists. This runs ffprobe, so it goes last.
+    if ext.lower() == ".mkv":
         try:
-            lang_code = subtitle_service.get_language_code(target_language)
             info = await subtitle_service.get_subtitle_tracks(file_path)
             for track in info.tracks:
                 if track.language and track.language.lower() == lang_code:
@@ -66,19 +166,20 @@ async def check_file_should_skip(
         except Exception as e:
             logger.warning(f"Failed to check subtitle tracks for {file_path}: {e}")
 
-    # 4. Check if output file already exists
-    base, ext = os.path.splitext(file_path)
-    lang_tag = subtitle_service.get_language_tag(target_language)
+    return False, ""
+
 
-    # Check for subtitle output files
+def _find_existing_output(base: str, ext: str, lang_tag: str) -> tuple[bool, str]:
+    """Check for output files of a file, given its base path and extension."""
+    # Check for subtitle output files (one cached listing per directory)
     for fmt in ["srt", "ass"]:
         output_path = f"{base}.{lang_tag}.{fmt}"
-        if os.path.exists(output_path):
+        if fscache.path_exists(output_path):
             return True, f"Output file already exists: {output_path}"
 
     # Check for translated MKV
     translated_mkv = f"{base}.translated{ext}"
-    if os.path.exists(translated_mkv):
+    if fscache.path_exists(translated_mkv):
         return True, f"Translated file already exists: {translated_mkv}"
 
     return False, ""
@@ -87,10 +188,16 @@ async def check_file_should_skip(
 @router.post("", response_model=TaskResponse)
 async def create_task(task: TaskCreate):
     """Create a new translation task."""
-    if not os.path.exists(task.file_path):
+    try:
+        st = os.stat(task.file_path)
+    except OSError:
         raise HTTPException(status_code=404, detail="File not found")
 
-    if not task.file_path.lower().endswith((".mkv", ".srt", ".ass")):
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    ext = os.path.splitext(task.file_path)[1].lower()
+    if ext not in (".mkv", ".srt", ".ass"):
         raise HTTPException(
             status_code=400,
             detail="File must be an MKV, SRT, or ASS file",
@@ -113,24 +220,47 @@ async def create_task(task: TaskCreate):
             """
             INSERT INTO tasks (file_path, file_name, target_language, llm_provider, subtitle_track, force_override)
             VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING *
             """,
             (
                 task.file_path,
                 file_name,
                 task.target_language,
                 task.llm_provider,
-                task.subtitle_track if task.file_path.lower().endswith(".mkv") else None,
+                task.subtitle_track if ext == ".mkv" else None,
                 1 if task.force_override else 0,
             ),
         )
+        # Read to the end so the statement finishes before committing
+        rows = await cursor.fetchall()
         await db.commit()
+        task_queue.notify()
 
-        cursor = await db.execute(
-            "SELECT * FROM tasks WHERE id = ?", (cursor.lastrowid,)
-        )
-        row = await cursor.fetchone()
+        return _row_to_task(rows[0])
 
-        return _row_to_task(row)
+
+def _iter_files(root: str, recursive: bool) -> Iterator[os.DirEntry]:
+    """Yield the files under root, descending into subdirectories if recursive.
+
+    Like os.walk, symlinked directories are not followed.
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            # Unreadable directories are skipped, as os.walk does
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    elif not entry.is_dir():
+                        yield entry
+                except OSError:
+                    continue
 
 
 @router.post("/directory")
@@ -140,32 +270,13 @@ async def create_directory_tasks(request: DirectoryTaskCreate):
         raise HTTPException(status_code=404, detail="Directory not found")
 
     mkv_files = []
-
-    def is_generated_subtitle(name: str) -> bool:
-        lower_name = name.lower()
-        if ".translated." in lower_name:
-            return True
-        if lower_name.endswith((".srt", ".ass")):
-            for tag in subtitle_service.get_known_language_tags():
-                if f".{tag.lower()}." in lower_name:
-                    return True
-        return False
-
-    if request.recursive:
-        for root, dirs, files in os.walk(request.directory_path):
-            for f in files:
-                if (
-                    f.lower().endswith((".mkv", ".srt", ".ass"))
-                    and not is_generated_subtitle(f)
-                ):
-                    mkv_files.append(os.path.join(root, f))
-    else:
-        for f in os.listdir(request.directory_path):
-            if (
-                f.lower().endswith((".mkv", ".srt", ".ass"))
-                and not is_generated_subtitle(f)
-            ):
-                mkv_files.append(os.path.join(request.directory_path, f))
+    for entry in _iter_files(request.directory_path, request.recursive):
+        lower_name = entry.name.lower()
+        if (
+            lower_name.endswith((".mkv", ".srt", ".ass"))
+            and not is_generated_subtitle(lower_name)
+        ):
+            mkv_files.append(entry.path)
 
     if not mkv_files:
         raise HTTPException(
@@ -175,36 +286,48 @@ async def create_directory_tasks(request: DirectoryTaskCreate):
 
     created_tasks = []
     skipped_files = []
+    files_to_create = []
 
-    async with get_db() as db:
-        for file_path in mkv_files:
-            # Check if file should be skipped
-            should_skip, reason = await check_file_should_skip(
-                db, file_path, request.target_language, request.force_override
+    skipped = await check_files_should_skip_bulk(
+        mkv_files, request.target_language, request.force_override
+    )
+    for file_path in mkv_files:
+        reason = skipped.get(file_path)
+        if reason:
+            skipped_files.append({"file": file_path, "reason": reason})
+            logger.info(f"Skipped {file_path}: {reason}")
+            continue
+
+        files_to_create.append(file_path)
+
+    if files_to_create:
+        force_override = 1 if request.force_override else 0
+        rows = [
+            (
+                file_path,
+                os.path.basename(file_path),
+                request.target_language,
+                request.llm_provider,
+                force_override,
             )
-            if should_skip:
-                skipped_files.append({"file": file_path, "reason": reason})
-                logger.info(f"Skipped {file_path}: {reason}")
-                continue
-
-            file_name = os.path.basename(file_path)
-
-            cursor = await db.execute(
+            for file_path in files_to_create
+        ]
+        async with get_db() as db, write_transaction(db):
+            await db.executemany(
                 """
                 INSERT INTO tasks (file_path, file_name, target_language, llm_provider, force_override)
                 VALUES (?, ?, ?, ?, ?)
                 """,
-                (
-                    file_path,
-                    file_name,
-                    request.target_language,
-                    request.llm_provider,
-                    1 if request.force_override else 0,
-                ),
+                rows,
             )
-            created_tasks.append(cursor.lastrowid)
+            cursor = await db.execute("SELECT last_insert_rowid()")
+            last_task_id = (await cursor.fetchone())[0]
 
-        await db.commit()
+        # The write lock is held for the whole insert, so the new ids
+        # are consecutive and end at the last inserted rowid
+        first_task_id = last_task_id - len(rows) + 1
+        created_tasks = list(range(first_task_id, last_task_id + 1))
+        task_queue.notify()
 
     return {
         "created_count": len(created_tasks),
@@ -222,36 +345,29 @@ async def list_tasks(
 ):
     """List all tasks with optional status filter and pagination."""
     async with get_db() as db:
-        # Get total count
-        if status:
-            count_cursor = await db.execute(
-                "SELECT COUNT(*) as count FROM tasks WHERE status = ?",
-                (status.value,),
-            )
-        else:
-            count_cursor = await db.execute("SELECT COUNT(*) as count FROM tasks")
-        count_row = await count_cursor.fetchone()
-        total = count_row["count"]
+        # The window count gives the total alongside the page in one query
+        where = "WHERE status = ?" if status else ""
+        params = (status.value,) if status else ()
+        cursor = await db.execute(
+            f"""
+            SELECT *, COUNT(*) OVER () AS total FROM tasks {where}
+            ORDER BY created_at DESC LIMIT ? OFFSET ?
+            """,
+            (*params, limit, offset),
+        )
+        rows = await cursor.fetchall()
 
-        # Get paginated tasks
-        if status:
+        if rows:
+            total = rows[0]["total"]
+        elif offset > 0:
+            # Past the last page there is no row to carry the total
             cursor = await db.execute(
-                """
-                SELECT * FROM tasks WHERE status = ?
-                ORDER BY created_at DESC LIMIT ? OFFSET ?
-                """,
-                (status.value, limit, offset),
+                f"SELECT COUNT(*) FROM tasks {where}", params
             )
+            total = (await cursor.fetchone())[0]
         else:
-            cursor = await db.execute(
-                """
-                SELECT * FROM tasks
-                ORDER BY created_at DESC LIMIT ? OFFSET ?
-                """,
-                (limit, offset),
-            )
+            total = 0
 
-        rows = await cursor.fetchall()
         tasks = [_row_to_task(row) for row in rows]
 
         return TaskListResponse(
@@ -295,8 +411,8 @@ async def pause_all_tasks():
     """Pause all pending tasks."""
     async with get_db() as db:
         cursor = await db.execute(
-            "UPDATE tasks SET status = ?, updated_at = ? WHERE status = ?",
-            (TaskStatus.PAUSED.value, datetime.now().isoformat(), TaskStatus.PENDING.value),
+            f"UPDATE tasks SET status = ?, updated_at = {SQL_NOW} WHERE status = ?",
+            (TaskStatus.PAUSED.value, TaskStatus.PENDING.value),
         )
         await db.commit()
 
@@ -309,11 +425,14 @@ async def pause_selected_tasks(request: TaskIdList):
     if not request.task_ids:
         raise HTTPException(status_code=400, detail="No task IDs provided")
 
-    placeholders = ",".join("?" for _ in request.task_ids)
     async with get_db() as db:
         cursor = await db.execute(
-            f"UPDATE tasks SET status = ?, updated_at = ? WHERE id IN ({placeholders}) AND status = ?",
-            [TaskStatus.PAUSED.value, datetime.now().isoformat(), *request.task_ids, TaskStatus.PENDING.value],
+            _SQL_SET_STATUS_FOR_IDS,
+            (
+                TaskStatus.PAUSED.value,
+                json.dumps(request.task_ids),
+                TaskStatus.PENDING.value,
+            ),
         )
         await db.commit()
 
@@ -323,16 +442,15 @@ async def pause_selected_tasks(request: TaskIdList):
 @router.delete("/delete-all")
 async def delete_all_tasks():
     """Delete all tasks, cancel processing tasks."""
-    async with get_db() as db:
+    async with get_db() as db, write_transaction(db):
         cancel_cursor = await db.execute(
-            "UPDATE tasks SET status = ?, updated_at = ? WHERE status = ?",
-            (TaskStatus.CANCELLED.value, datetime.now().isoformat(), TaskStatus.PROCESSING.value),
+            f"UPDATE tasks SET status = ?, updated_at = {SQL_NOW} WHERE status = ?",
+            (TaskStatus.CANCELLED.value, TaskStatus.PROCESSING.value),
         )
         delete_cursor = await db.execute(
             "DELETE FROM tasks WHERE status != ?",
             (TaskStatus.PROCESSING.value,),
         )
-        await db.commit()
 
     return {
         "cancelled_count": cancel_cursor.rowcount,
@@ -346,17 +464,23 @@ async def delete_selected_tasks(request: TaskIdList):
     if not request.task_ids:
         raise HTTPException(status_code=400, detail="No task IDs provided")
 
-    placeholders = ",".join("?" for _ in request.task_ids)
-    async with get_db() as db:
+    ids_json = json.dumps(request.task_ids)
+    async with get_db() as db, write_transaction(db):
         cancel_cursor = await db.execute(
-            f"UPDATE tasks SET status = ?, updated_at = ? WHERE id IN ({placeholders}) AND status = ?",
-            [TaskStatus.CANCELLED.value, datetime.now().isoformat(), *request.task_ids, TaskStatus.PROCESSING.value],
+            _SQL_SET_STATUS_FOR_IDS,
+            (
+                TaskStatus.CANCELLED.value,
+                ids_json,
+                TaskStatus.PROCESSING.value,
+            ),
         )
         delete_cursor = await db.execute(
-            f"DELETE FROM tasks WHERE id IN ({placeholders}) AND status != ?",
-            [*request.task_ids, TaskStatus.PROCESSING.value],
+            """
+            DELETE FROM tasks
+            WHERE id IN (SELECT value FROM json_each(?)) AND status != ?
+            """,
+            (ids_json, TaskStatus.PROCESSING.value),
         )
-        await db.commit()
 
     return {
         "cancelled_count": cancel_cursor.rowcount,
@@ -428,13 +552,14 @@ async def retry_task(task_id: int):
             )
 
         await db.execute(
-            """
+            f"""
             UPDATE tasks SET status = ?, progress = 0, error_message = NULL,
-            updated_at = ? WHERE id = ?
+            updated_at = {SQL_NOW} WHERE id = ?
             """,
-            (TaskStatus.PENDING.value, datetime.now().isoformat(), task_id),
+            (TaskStatus.PENDING.value, task_id),
         )
         await db.commit()
+    task_queue.notify()
 
     return {"status": "ok"}
 
@@ -62,12 +62,15 @@ async def create_watcher(watcher: WatcherCreate):
             """
             INSERT INTO watchers (path, target_language, llm_provider)
             VALUES (?, ?, ?)
+            RETURNING *
             """,
             (watcher.path, watcher.target_language, watcher.llm_provider),
         )
+        # Read to the end so the statement finishes before committing
+        row = (await cursor.fetchall())[0]
         await db.commit()
 
-        watcher_id = cursor.lastrowid
+        watcher_id = row["id"]
 
         # Start watching
         try:
@@ -90,11 +93,6 @@ async def create_watcher(watcher: WatcherCreate):
             await db.commit()
             raise HTTPException(status_code=500, detail=str(e))
 
-        cursor = await db.execute(
-            "SELECT * FROM watchers WHERE id = ?", (watcher_id,)
-        )
-        row = await cursor.fetchone()
-
         return WatcherResponse(
             id=row["id"],
             path=row["path"],
@@ -0,0 +1,51 @@
+import os
+import time
+
+# A listing taken this soon (seconds) after the directory's mtime may have
+# missed a change made within the same mtime tick, so it is not reused
+RACY_WINDOW = 2.0
+
+# Drop everything once this many directories are cached
+MAX_CACHED_DIRS = 1024
+
+# dir path -> (mtime_ns, entry names)
+_listings: dict[str, tuple[int, frozenset[str]]] = {}
+
+
+def list_dir(dir_path: str) -> frozenset[str]:
+    """Return the entry names in a directory, cached by directory mtime.
+
+    Each lookup costs a single stat; the directory is only scanned again
+    when its mtime changed.
+    """
+    key = os.path.abspath(dir_path)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+        cached = _listings.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with os.scandir(key) as it:
+            names = frozenset(entry.name for entry in it)
+    except OSError:
+        _listings.pop(key, None)
+        return frozenset()
+
+    if time.time() - mtime / 1e9 < RACY_WINDOW:
+        _listings.pop(key, None)
+        return names
+
+    if len(_listings) >= MAX_CACHED_DIRS:
+        _listings.clear()
+    _listings[key] = (mtime, names)
+    return names
+
+
+def path_exists(path: str) -> bool:
+    """Check whether a path exists using the cached parent listing."""
+    directory, name = os.path.split(path)
+    return name in list_dir(directory or ".")
+
+
+def invalidate_dir(dir_path: str):
+    """Forget the cached listing for a directory."""
+    _listings.pop(os.path.abspath(dir_path), None)
@@ -1,34 +1,55 @@
 import asyncio
+import json
+import time
+from collections import deque
 from typing import Optional, Callable, Awaitable
-from datetime import datetime
 import aiosqlite
-from ..database import DATABASE_PATH, get_db
+from ..database import DATABASE_PATH, SQL_NOW, get_db
 from ..models.task import TaskStatus
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Minimum seconds between progress writes to the database for one task.
+# Progress callbacks still see every update, and the latest skipped value is
+# written with the task's final status.
+PROGRESS_WRITE_INTERVAL = 0.5
+
+# Idle workers recheck for pending tasks at least this often (seconds), in
+# case a task was added without notify()
+IDLE_POLL_INTERVAL = 5.0
+
 
 class TaskQueue:
     def __init__(self):
         self._running = False
-        self._workers: list[asyncio.Task] = []
+        # Workers remove themselves from the set when they finish
+        self._workers: set[asyncio.Task] = set()
         self._task_handler: Optional[Callable[[int], Awaitable[None]]] = None
         self._max_concurrent = 2
         self._progress_callbacks: dict[int, Callable[[int, int], Awaitable[None]]] = {}
+        self._progress_written_at: dict[int, float] = {}
+        self._unwritten_progress: dict[int, int] = {}
+        self._new_task_event = asyncio.Event()
+        # Tasks claimed in one statement for idle workers, not yet picked up
+        self._claimed: deque[int] = deque()
+        self._claim_lock = asyncio.Lock()
+        self._idle_workers = 0
 
     def set_task_handler(self, handler: Callable[[int], Awaitable[None]]):
         """Set the handler function for processing tasks."""
         self._task_handler = handler
 
+    @property
+    def max_concurrent(self) -> int:
+        """Maximum number of tasks processed at once."""
+        return self._max_concurrent
+
     def set_max_concurrent(self, max_concurrent: int):
         """Set maximum concurrent tasks."""
         self._max_concurrent = max_concurrent
         if self._running:
-            self._reap_done_workers()
-            for i in range(len(self._workers), self._max_concurrent):
-                worker = asyncio.create_task(self._worker(i))
-                self._workers.append(worker)
+            self._start_workers()
 
     async def start(self):
         """Start the task queue workers."""
@@ -36,10 +57,7 @@ class TaskQueue:
             return
 
         self._running = True
-        self._reap_done_workers()
-        for i in range(self._max_concurrent):
-            worker = asyncio.create_task(self._worker(i))
-            self._workers.append(worker)
+        self._start_workers()
         logger.info(f"Task queue started with {self._max_concurrent} workers")
 
     async def stop(self):
@@ -48,91 +66,142 @@ class TaskQueue:
         for worker in self._workers:
             worker.cancel()
         self._workers.clear()
+        self._idle_workers = 0
+        await self._release_claimed()
         logger.info("Task queue stopped")
 
     async def _worker(self, worker_id: int):
         """Worker coroutine that processes tasks from the queue."""
         logger.info(f"Worker {worker_id} started")
 
-        while self._running:
-            if worker_id >= self._max_concurrent:
-                break
-            try:
-                task_id = await self._claim_next_task()
+        self._idle_workers += 1
+        try:
+            while self._running:
+                if worker_id >= self._max_concurrent:
+                    break
+                try:
+                    task_id = await self._next_task()
 
-                if task_id is None:
-                    await asyncio.sleep(1)
-                    continue
+                    if task_id is None:
+                        await self._wait_for_tasks()
+                        continue
 
-                logger.info(f"Worker {worker_id} processing task {task_id}")
+                    logger.info(f"Worker {worker_id} processing task {task_id}")
 
-                try:
-                    if self._task_handler:
-                        await self._task_handler(task_id)
+                    self._idle_workers -= 1
+                    try:
+                        if self._task_handler:
+                            await self._task_handler(task_id)
 
-                    status = await self._get_task_status(task_id)
-                    if status == TaskStatus.CANCELLED.value:
-                        logger.info(f"Task {task_id} cancelled, skipping completion")
-                    else:
-                        await self._update_task_status(
+                        if await self._update_task_status(
                             task_id, TaskStatus.COMPLETED, progress=100
-                        )
-                        logger.info(f"Task {task_id} completed")
+                        ):
+                            logger.info(f"Task {task_id} completed")
+                        else:
+                            logger.info(f"Task {task_id} cancelled, skipping completion")
 
-                except Exception as e:
-                    logger.error(f"Task {task_id} failed: {e}")
-                    status = await self._get_task_status(task_id)
-                    if status != TaskStatus.CANCELLED.value:
+                    except Exception as e:
+                        logger.error(f"Task {task_id} failed: {e}")
                         await self._update_task_status(
-                            task_id, TaskStatus.FAILED, error_message=str(e)
+                            task_id,
+                            TaskStatus.FAILED,
+                            progress=self._unwritten_progress.get(task_id),
+                            error_message=str(e),
                         )
+                    finally:
+                        self._idle_workers += 1
+                        self._progress_written_at.pop(task_id, None)
+                        self._unwritten_progress.pop(task_id, None)
 
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"Worker {worker_id} error: {e}")
-                await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    break
+                except Exception as e:
+                    logger.error(f"Worker {worker_id} error: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            self._idle_workers = max(self._idle_workers - 1, 0)
 
         logger.info(f"Worker {worker_id} stopped")
 
-    def _reap_done_workers(self):
-        """Remove completed worker tasks from the list."""
-        self._workers = [worker for worker in self._workers if not worker.done()]
+    def notify(self):
+        """Wake idle workers after pending tasks were added."""
+        self._new_task_event.set()
 
-    async def _claim_next_task(self) -> Optional[int]:
-        """Atomically claim the next pending task and mark it as processing."""
+    async def _wait_for_tasks(self):
+        """Sleep until notify() is called or the idle poll interval passes."""
+        try:
+            await asyncio.wait_for(
+                self._new_task_event.wait(), timeout=IDLE_POLL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
+        self._new_task_event.clear()
+
+    def _start_workers(self):
+        """Start workers until max_concurrent are running."""
+        for i in range(len(self._workers), self._max_concurrent):
+            worker = asyncio.create_task(self._worker(i))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+    async def _next_task(self) -> Optional[int]:
+        """Return the next claimed task, claiming one per idle worker if needed."""
+        async with self._claim_lock:
+            if not self._claimed:
+                self._claimed.extend(
+                    await self._claim_tasks(max(self._idle_workers, 1))
+                )
+                if len(self._claimed) > 1:
+                    # Wake the other idle workers to pick up the rest
+                    self.notify()
+            return self._claimed.popleft() if self._claimed else None
+
+    async def _claim_tasks(self, limit: int) -> list[int]:
+        """Atomically claim up to limit pending tasks and mark them as processing."""
         async with get_db() as db:
             cursor = await db.execute(
-                """
+                f"""
                 UPDATE tasks
-                SET status = ?, updated_at = ?
-                WHERE id = (
+                SET status = ?, updated_at = {SQL_NOW}
+                WHERE id IN (
                     SELECT id FROM tasks
                     WHERE status = ?
                     ORDER BY created_at ASC
-                    LIMIT 1
+                    LIMIT ?
                 )
-                RETURNING id
+                RETURNING id, created_at
                 """,
                 (
                     TaskStatus.PROCESSING.value,
-                    datetime.now().isoformat(),
                     TaskStatus.PENDING.value,
+                    limit,
                 ),
             )
-            row = await cursor.fetchone()
+            rows = await cursor.fetchall()
             await db.commit()
-            return row["id"] if row else None
+        # RETURNING order is unspecified, so restore the queue order
+        rows = sorted(rows, key=lambda row: (row["created_at"], row["id"]))
+        return [row["id"] for row in rows]
 
-    async def _get_task_status(self, task_id: int) -> Optional[str]:
-        """Fetch current task status from the database."""
+    async def _release_claimed(self):
+        """Return claimed tasks no worker picked up to the pending state."""
+        if not self._claimed:
+            return
+        task_ids = list(self._claimed)
+        self._claimed.clear()
         async with get_db() as db:
-            cursor = await db.execute(
-                "SELECT status FROM tasks WHERE id = ?",
-                (task_id,),
+            await db.execute(
+                """
+                UPDATE tasks SET status = ?
+                WHERE id IN (SELECT value FROM json_each(?)) AND status = ?
+                """,
+                (
+                    TaskStatus.PENDING.value,
+                    json.dumps(task_ids),
+                    TaskStatus.PROCESSING.value,
+                ),
             )
-            row = await cursor.fetchone()
-            return row["status"] if row else None
+            await db.commit()
 
     async def _update_task_status(
         self,
@@ -140,11 +209,14 @@ class TaskQueue:
         status: TaskStatus,
         progress: Optional[int] = None,
         error_message: Optional[str] = None,
-    ):
-        """Update task status in the database."""
+    ) -> bool:
+        """Update task status in the database unless it was cancelled.
+
+        Returns False if the task was cancelled (or deleted) meanwhile.
+        """
         async with get_db() as db:
-            updates = ["status = ?", "updated_at = ?"]
-            params = [status.value, datetime.now().isoformat()]
+            updates = ["status = ?", f"updated_at = {SQL_NOW}"]
+            params = [status.value]
 
             if progress is not None:
                 updates.append("progress = ?")
@@ -155,25 +227,42 @@ class TaskQueue:
                 params.append(error_message)
 
             if status == TaskStatus.COMPLETED:
-                updates.append("completed_at = ?")
-                params.append(datetime.now().isoformat())
+                updates.append(f"completed_at = {SQL_NOW}")
 
-            params.append(task_id)
+            params.extend([task_id, TaskStatus.CANCELLED.value])
 
-            await db.execute(
-                f"UPDATE tasks SET {', '.join(updates)} WHERE id = ?",
+            cursor = await db.execute(
+                f"""
+                UPDATE tasks SET {', '.join(updates)}
+                WHERE id = ? AND status != ?
+                RETURNING status
+                """,
                 params,
             )
+            # Read to the end so the statement finishes and releases its lock
+            rows = await cursor.fetchall()
             await db.commit()
+            return bool(rows)
 
     async def update_progress(self, task_id: int, progress: int):
         """Update task progress."""
-        async with get_db() as db:
-            await db.execute(
-                "UPDATE tasks SET progress = ?, updated_at = ? WHERE id = ?",
-                (progress, datetime.now().isoformat(), task_id),
-            )
-            await db.commit()
+        now = time.monotonic()
+        written_at = self._progress_written_at.get(task_id)
+        if (
+            progress >= 100
+            or written_at is None
+            or now - written_at >= PROGRESS_WRITE_INTERVAL
+        ):
+            self._progress_written_at[task_id] = now
+            self._unwritten_progress.pop(task_id, None)
+            async with get_db() as db:
+                await db.execute(
+                    f"UPDATE tasks SET progress = ?, updated_at = {SQL_NOW} WHERE id = ?",
+                    (progress, task_id),
+                )
+                await db.commit()
+        else:
+            self._unwritten_progress[task_id] = progress
 
         # Call progress callback if registered
         if task_id in self._progress_callbacks:
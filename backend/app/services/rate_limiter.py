@@ -0,0 +1,145 @@
+import asyncio
+import time
+from typing import Iterable
+
+# Rough characters per token, used when estimating request sizes. Scripts
+# like CJK take about a token per character, so only ASCII is divided.
+CHARS_PER_TOKEN = 4
+
+# Tokens of instructions added around the lines of each request
+PROMPT_OVERHEAD_TOKENS = 200
+
+# Rate multiplier applied on a 429, the floor it can fall to, and the step
+# it recovers by after each successful request
+PENALTY_FACTOR = 0.5
+MIN_RATE_SCALE = 0.1
+RECOVERY_STEP = 0.05
+
+# Seconds every request waits after a 429
+PENALTY_PAUSE = 2.0
+
+# Without a configured requests-per-minute limit, seconds between requests
+# at half rate. The spacing is 0 at full rate and grows as the rate is cut.
+UNLIMITED_BASE_SPACING = 1.0
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+    """Estimate the tokens a translation request uses, prompt and reply."""
+    line_tokens = 0
+    for text in texts:
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        line_tokens += ascii_chars // CHARS_PER_TOKEN + len(text) - ascii_chars
+    # The reply is about as long as the lines sent
+    return 2 * line_tokens + PROMPT_OVERHEAD_TOKENS
+
+
+class AsyncLeakyBucket:
+    """Requests-per-minute and tokens-per-minute limiter shared by tasks.
+
+    Both budgets refill continuously. A limit of 0 means unlimited. After a
+    rate-limit response requests pause briefly and the rate is cut
+    multiplicatively, then recovers additively with each successful request
+    (AIMD). Without a requests-per-minute limit the cut rate is applied as
+    spacing between requests.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._rate_scale = 1.0
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_request_at = 0.0
+        # Waiters are served in arrival order
+        self._lock = asyncio.Lock()
+
+    def set_limits(self, rpm: int, tpm: int):
+        """Change the limits, keeping the current budgets within them."""
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = min(self._requests, float(rpm))
+        self._tokens = min(self._tokens, float(tpm))
+
+    async def acquire(self, requests: int = 1, tokens: int = 0):
+        """Wait until the budgets allow a request of this size."""
+        # A request larger than the bucket could never fit, so cap it
+        if self.rpm:
+            requests = min(requests, self.rpm)
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+
+        async with self._lock:
+            while True:
+                self._refill()
+                now = time.monotonic()
+                wait = max(
+                    self._wait_time(self._requests, requests, self.rpm),
+                    self._wait_time(self._tokens, tokens, self.tpm),
+                    self._paused_until - now,
+                    self._last_request_at + self._spacing() - now,
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self._last_request_at = time.monotonic()
+            if self.rpm:
+                self._requests -= requests
+            if self.tpm:
+                self._tokens -= tokens
+
+    def penalize(self):
+        """Slow down after the provider answered with a rate-limit error."""
+        self._refill()
+        self._rate_scale = max(self._rate_scale * PENALTY_FACTOR, MIN_RATE_SCALE)
+        self._paused_until = time.monotonic() + PENALTY_PAUSE
+        # Drop the saved-up burst as well, the provider is already over
+        self._requests = min(self._requests, 0.0)
+        self._tokens = min(self._tokens, 0.0)
+
+    def reward(self):
+        """Speed back up after a successful request."""
+        self._rate_scale = min(self._rate_scale + RECOVERY_STEP, 1.0)
+
+    def _refill(self):
+        """Add the budget accrued since the last refill."""
+        now = time.monotonic()
+        minutes = (now - self._updated_at) / 60
+        self._updated_at = now
+        if self.rpm:
+            self._requests = min(
+                self._requests + minutes * self.rpm * self._rate_scale, self.rpm
+            )
+        if self.tpm:
+            self._tokens = min(
+                self._tokens + minutes * self.tpm * self._rate_scale, self.tpm
+            )
+
+    def _spacing(self) -> float:
+        """Seconds to keep between requests when no rpm limit is set."""
+        if self.rpm:
+            # The scaled refill already slows requests down
+            return 0.0
+        return UNLIMITED_BASE_SPACING * (1 / self._rate_scale - 1)
+
+    def _wait_time(self, available: float, needed: int, limit: int) -> float:
+        """Seconds until a budget holds the needed amount."""
+        if not limit or available >= needed:
+            return 0.0
+        return (needed - available) * 60 / (limit * self._rate_scale)
+
+
+# One limiter per provider, shared by every LLM instance and task
+_limiters: dict[str, AsyncLeakyBucket] = {}
+
+
+def get_rate_limiter(name: str, rpm: int, tpm: int) -> AsyncLeakyBucket:
+    """Return the shared limiter for a provider, applying the current limits."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = AsyncLeakyBucket(rpm, tpm)
+    elif limiter.rpm != rpm or limiter.tpm != tpm:
+        limiter.set_limits(rpm, tpm)
+    return limiter
@@ -1,16 +1,73 @@
 import asyncio
 import json
+import mmap
 import os
+import re
+import sqlite3
 import tempfile
-from copy import deepcopy
+import threading
+import time
 from typing import Optional
 from dataclasses import dataclass
 import pysubs2
 import logging
-import chardet
+
+try:
+    # C implementation with the same detect() API, much faster when installed
+    import cchardet as chardet
+except ImportError:
+    import chardet
 
 logger = logging.getLogger(__name__)
 
+# Image-based subtitle codecs, which can't be extracted as text
+GRAPHICAL_CODECS = frozenset({"hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle"})
+
+# Language tags used in output filenames (see get_language_tag)
+KNOWN_LANGUAGE_TAGS = frozenset(
+    {"zh-Hans", "en", "ja", "ko", "fr", "de", "es", "ru", "pt", "it", "und"}
+)
+KNOWN_LANGUAGE_TAGS_LOWER = frozenset(tag.lower() for tag in KNOWN_LANGUAGE_TAGS)
+
+# Bytes sampled from the start of a file for encoding detection
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Finds where an ASCII-only sample should be taken from instead
+_NON_ASCII_RE = re.compile(rb"[\x80-\xff]")
+
+# Byte order marks, longest first since the UTF-32 LE mark starts with UTF-16's
+_BOMS = (
+    (b"\xff\xfe\x00\x00", "utf-32"),
+    (b"\x00\x00\xfe\xff", "utf-32"),
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+)
+
+# Detected encodings, kept across restarts and keyed by absolute path with
+# the file's mtime and size. Files in the temp directory (tracks extracted
+# for translation) are never looked up twice, so they aren't cached.
+ENCODING_CACHE_PATH = "./data/encodings.db"
+# Rows kept in the encoding cache; the least recently used are deleted when
+# it is opened
+ENCODING_CACHE_MAX_ROWS = 50_000
+_encoding_cache: Optional[sqlite3.Connection] = None
+# Parsing runs both on the event loop and in worker threads
+_encoding_cache_lock = threading.Lock()
+
+# ffprobe results keyed by path, stored with the file's (mtime_ns, size)
+MAX_PROBE_CACHE = 512
+_probe_cache: dict[str, tuple[tuple[int, int], list["SubtitleTrack"]]] = {}
+# Probes still running, keyed by (path, mtime_ns, size), so concurrent
+# callers for the same file version share one ffprobe process
+_probes_in_flight: dict[tuple[str, int, int], asyncio.Future] = {}
+
+# Text tracks extracted together from recent MKVs, keyed by path and stored
+# with the file's (mtime_ns, size): track index -> SRT contents. An empty
+# dict records that the combined extraction failed for that version.
+MAX_TEXT_TRACK_CACHE = 8
+_text_track_cache: dict[str, tuple[tuple[int, int], dict[int, bytes]]] = {}
+
 
 @dataclass
 class SubtitleTrack:
@@ -39,6 +96,50 @@ async def run_command(cmd: list[str]) -> tuple[int, str, str]:
 
 async def get_subtitle_tracks(file_path: str) -> SubtitleInfo:
     """Get subtitle tracks from an MKV file using ffprobe."""
+    try:
+        st = os.stat(file_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+
+    cached = _probe_cache.get(file_path)
+    if stamp and cached and cached[0] == stamp:
+        return SubtitleInfo(file_path=file_path, tracks=list(cached[1]))
+
+    if stamp is None:
+        tracks = await _probe_subtitle_tracks(file_path)
+        return SubtitleInfo(file_path=file_path, tracks=list(tracks))
+
+    key = (file_path, *stamp)
+    future = _probes_in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_probe_subtitle_tracks(file_path))
+        _probes_in_flight[key] = future
+        future.add_done_callback(
+            lambda done: _finish_probe(key, stamp, done)
+        )
+    # Shielded so one caller being cancelled doesn't kill the shared probe
+    tracks = await asyncio.shield(future)
+    return SubtitleInfo(file_path=file_path, tracks=list(tracks))
+
+
+def _finish_probe(
+    key: tuple[str, int, int], stamp: tuple[int, int], future: asyncio.Future
+):
+    """Move a finished probe's tracks from the in-flight map to the cache."""
+    _probes_in_flight.pop(key, None)
+    if future.cancelled() or future.exception() is not None:
+        return
+    file_path = key[0]
+    _probe_cache.pop(file_path, None)
+    if len(_probe_cache) >= MAX_PROBE_CACHE:
+        # Dicts keep insertion order, so this drops the oldest entry
+        del _probe_cache[next(iter(_probe_cache))]
+    _probe_cache[file_path] = (stamp, future.result())
+
+
+async def _probe_subtitle_tracks(file_path: str) -> list[SubtitleTrack]:
+    """Run ffprobe and return the subtitle tracks of a file."""
     cmd = [
         "ffprobe",
         "-v", "quiet",
@@ -65,20 +166,21 @@ async def get_subtitle_tracks(file_path: str) -> SubtitleInfo:
         )
         tracks.append(track)
 
-    return SubtitleInfo(file_path=file_path, tracks=tracks)
+    return tracks
 
 
 async def extract_subtitle(
     file_path: str,
     track_index: int,
     output_path: Optional[str] = None,
+    track_info: Optional[SubtitleInfo] = None,
 ) -> str:
-    """Extract a subtitle track from an MKV file."""
-    if output_path is None:
-        output_path = tempfile.mktemp(suffix=".srt")
+    """Extract a subtitle track from an MKV file.
 
+    track_info, if the caller already has it, saves probing the file again.
+    """
     # Get track info to determine codec
-    info = await get_subtitle_tracks(file_path)
+    info = track_info or await get_subtitle_tracks(file_path)
     track = next((t for t in info.tracks if t.index == track_index), None)
 
     if track is None:
@@ -91,13 +193,30 @@ async def extract_subtitle(
             break
         subtitle_stream_index += 1
 
-    # PGS subtitles (hdmv_pgs_subtitle) cannot be extracted as text
-    if track.codec in ["hdmv_pgs_subtitle", "dvd_subtitle"]:
+    # PGS/DVD/DVB subtitles cannot be extracted as text
+    if track.codec in GRAPHICAL_CODECS:
         raise ValueError(
             f"Subtitle track {track_index} is a graphical subtitle ({track.codec}), "
             "text extraction not supported"
         )
 
+    created_output = output_path is None
+    if created_output:
+        # Created up front so concurrent extractions can't pick the same name;
+        # ffmpeg -y overwrites it
+        fd, output_path = tempfile.mkstemp(suffix=".srt")
+        os.close(fd)
+
+    # Extracting every text track at once only pays off when there are
+    # others to reuse; with a single one it would just be the same pass
+    text_track_count = sum(t.codec not in GRAPHICAL_CODECS for t in info.tracks)
+    if text_track_count > 1:
+        contents = (await _get_text_tracks(file_path, info)).get(track_index)
+        if contents is not None:
+            with open(output_path, "wb") as f:
+                f.write(contents)
+            return output_path
+
     cmd = [
         "ffmpeg",
         "-y",
@@ -110,11 +229,83 @@ async def extract_subtitle(
     returncode, stdout, stderr = await run_command(cmd)
 
     if returncode != 0:
+        if created_output:
+            os.remove(output_path)
         raise RuntimeError(f"ffmpeg extraction failed: {stderr}")
 
     return output_path
 
 
+async def _get_text_tracks(file_path: str, info: SubtitleInfo) -> dict[int, bytes]:
+    """Return the file's extracted text tracks, extracting them if needed.
+
+    Returns an empty dict if the tracks could not be extracted together.
+    """
+    try:
+        st = os.stat(file_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+
+    cached = _text_track_cache.get(file_path)
+    if stamp and cached and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        tracks = await extract_all_text_tracks(file_path, info)
+    except RuntimeError as e:
+        # One track ffmpeg can't convert fails the whole pass
+        logger.warning(
+            f"Extracting all text tracks of {file_path} together failed, "
+            f"falling back to one track at a time: {e}"
+        )
+        tracks = {}
+
+    if stamp:
+        _text_track_cache.pop(file_path, None)
+        if len(_text_track_cache) >= MAX_TEXT_TRACK_CACHE:
+            # Dicts keep insertion order, so this drops the oldest entry
+            del _text_track_cache[next(iter(_text_track_cache))]
+        _text_track_cache[file_path] = (stamp, tracks)
+    return tracks
+
+
+async def extract_all_text_tracks(
+    file_path: str, track_info: Optional[SubtitleInfo] = None
+) -> dict[int, bytes]:
+    """Extract every text subtitle track of an MKV file in one ffmpeg pass.
+
+    Returns the SRT contents of each track by track index.
+    """
+    info = track_info or await get_subtitle_tracks(file_path)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cmd = ["ffmpeg", "-y", "-i", file_path]
+        outputs = {}
+        # Subtitle stream positions count graphical tracks too
+        for position, track in enumerate(info.tracks):
+            if track.codec in GRAPHICAL_CODECS:
+                continue
+            output = os.path.join(temp_dir, f"{track.index}.srt")
+            cmd += ["-map", f"0:s:{position}", "-c:s", "srt", output]
+            outputs[track.index] = output
+
+        if not outputs:
+            return {}
+
+        returncode, stdout, stderr = await run_command(cmd)
+
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg extraction failed: {stderr}")
+
+        tracks = {}
+        for index, output in outputs.items():
+            with open(output, "rb") as f:
+                tracks[index] = f.read()
+
+    return tracks
+
+
 async def mux_subtitle(
     video_path: str,
     subtitle_path: str,
@@ -144,15 +335,122 @@ async def mux_subtitle(
 
 
 def detect_encoding(file_path: str) -> str:
-    """Detect file encoding using chardet."""
+    """Detect file encoding, reusing the result cached for this file version."""
+    path = os.path.abspath(file_path)
+    if path.startswith(tempfile.gettempdir() + os.sep):
+        return _detect_encoding(path)
+
+    st = os.stat(path)
+    try:
+        with _encoding_cache_lock:
+            row = _get_encoding_cache().execute(
+                "SELECT mtime, size, encoding FROM encodings WHERE path = ?",
+                (path,),
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Encoding cache lookup failed: {e}")
+        return _detect_encoding(path)
+
+    if row and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+        try:
+            with _encoding_cache_lock:
+                _get_encoding_cache().execute(
+                    "UPDATE encodings SET accessed_at = ? WHERE path = ?",
+                    (int(time.time()), path),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Encoding cache update failed: {e}")
+        return row[2]
+
+    encoding = _detect_encoding(path)
+    try:
+        with _encoding_cache_lock:
+            _get_encoding_cache().execute(
+                """
+                INSERT OR REPLACE INTO encodings
+                    (path, mtime, size, encoding, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (path, st.st_mtime_ns, st.st_size, encoding, int(time.time())),
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Encoding cache update failed: {e}")
+    return encoding
+
+
+def _get_encoding_cache() -> sqlite3.Connection:
+    """Open the encoding cache database on first use."""
+    global _encoding_cache
+    if _encoding_cache is None:
+        os.makedirs(os.path.dirname(ENCODING_CACHE_PATH), exist_ok=True)
+        db = sqlite3.connect(
+            ENCODING_CACHE_PATH, isolation_level=None, check_same_thread=False
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS encodings (
+                path TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                encoding TEXT NOT NULL,
+                accessed_at INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        try:
+            db.execute(
+                "ALTER TABLE encodings ADD COLUMN accessed_at INTEGER NOT NULL DEFAULT 0"
+            )
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        db.execute(
+            """
+            DELETE FROM encodings WHERE path IN (
+                SELECT path FROM encodings
+                ORDER BY accessed_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (ENCODING_CACHE_MAX_ROWS,),
+        )
+        _encoding_cache = db
+    return _encoding_cache
+
+
+def _detect_encoding(file_path: str) -> str:
+    """Detect file encoding from its BOM, or using chardet."""
     with open(file_path, 'rb') as f:
-        raw_data = f.read()
+        raw_data = f.read(ENCODING_SAMPLE_SIZE)
+        for bom, encoding in _BOMS:
+            if raw_data.startswith(bom):
+                return encoding
+
+        # Detection settles well within the sample, unless the sample is
+        # plain ASCII and the text that tells encodings apart comes later
+        if raw_data.isascii() and len(raw_data) == ENCODING_SAMPLE_SIZE:
+            raw_data = _sample_non_ascii(f) or raw_data
+
     result = chardet.detect(raw_data)
-    encoding = result.get('encoding', 'utf-8')
-    # Handle common encoding aliases
-    if encoding and encoding.lower() in ['utf-16', 'utf-16le', 'utf-16be']:
-        return encoding
-    return encoding or 'utf-8'
+    return result.get('encoding') or 'utf-8'
+
+
+def _sample_non_ascii(f) -> Optional[bytes]:
+    """Return a sample of f starting at its first non-ASCII byte.
+
+    Returns None if the whole file is ASCII. The file is memory-mapped, so
+    the search doesn't read it into memory.
+    """
+    try:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            match = _NON_ASCII_RE.search(mm, ENCODING_SAMPLE_SIZE)
+            if match is None:
+                return None
+            start = match.start()
+            return mm[start:start + ENCODING_SAMPLE_SIZE]
+    except (OSError, ValueError):
+        # Not mappable (special filesystems); read the rest instead
+        f.seek(0)
+        return f.read()
 
 
 def parse_subtitle(file_path: str) -> pysubs2.SSAFile:
@@ -175,24 +473,24 @@ def create_bilingual_subtitle(
     """Create a bilingual subtitle by combining original and translated."""
     bilingual = pysubs2.SSAFile()
 
-    base_size = None
+    # Text around the original line: a smaller font for ASS, nothing otherwise
+    prefix = "\\N"
+    suffix = ""
     if output_format == "ass":
         default_style = original.styles.get("Default")
         if default_style:
             base_size = int(default_style.fontsize)
         else:
             base_size = 20
-        smaller_size = max(10, int(base_size * 0.8))
+        if base_size:
+            smaller_size = max(10, int(base_size * 0.8))
+            prefix = f"\\N{{\\fs{smaller_size}}}"
+            suffix = "{\\r}"
 
     for orig_event, trans_event in zip(original.events, translated.events):
-        new_event = deepcopy(orig_event)
-        if output_format == "ass" and base_size:
-            new_event.text = (
-                f"{trans_event.text}\\N{{\\fs{smaller_size}}}"
-                f"{orig_event.text}{{\\r}}"
-            )
-        else:
-            new_event.text = f"{trans_event.text}\\N{orig_event.text}"
+        # Event fields are plain values, so a shallow copy is enough
+        new_event = orig_event.copy()
+        new_event.text = f"{trans_event.text}{prefix}{orig_event.text}{suffix}"
         bilingual.events.append(new_event)
 
     return bilingual
@@ -234,16 +532,4 @@ def get_language_tag(language: str) -> str:
 
 def get_known_language_tags() -> list[str]:
     """Return known language tags used for output filenames."""
-    return [
-        "zh-Hans",
-        "en",
-        "ja",
-        "ko",
-        "fr",
-        "de",
-        "es",
-        "ru",
-        "pt",
-        "it",
-        "und",
-    ]
+    return list(KNOWN_LANGUAGE_TAGS)
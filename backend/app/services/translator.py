@@ -1,38 +1,134 @@
+import asyncio
 import os
-import shutil
+import stat
 import tempfile
-from copy import deepcopy
-from typing import Callable, Awaitable, Optional
+from copy import copy
+from typing import Callable, Awaitable, Iterator, Optional
 import pysubs2
 from ..llm.base import BaseLLM
-from ..llm.openai import OpenAILLM
-from ..llm.claude import ClaudeLLM
-from ..llm.deepseek import DeepSeekLLM
-from ..llm.glm import GLMLLM
 from ..config import settings
 from . import subtitle as subtitle_service
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Batch size for translation
-BATCH_SIZE = 20
+# Longest wait (seconds) before retrying a single line that failed
+MAX_RETRY_BACKOFF = 16.0
+
+# HTTP statuses that retrying or splitting a batch cannot fix (bad request,
+# auth, permission, unknown model)
+PERMANENT_ERROR_STATUSES = {400, 401, 403, 404, 422}
+
+# Default limits on the lines and characters sent in one translation batch
+BATCH_MAX_COUNT = 40
+BATCH_MAX_CHARS = 3000
 
 
 def get_llm(provider: str) -> BaseLLM:
     """Get LLM instance by provider name."""
+    # Provider modules are imported on first use so only the configured SDK
+    # (openai or anthropic) is loaded.
     if provider == "openai":
+        from ..llm.openai import OpenAILLM
         return OpenAILLM()
     elif provider == "claude":
+        from ..llm.claude import ClaudeLLM
         return ClaudeLLM()
     elif provider == "deepseek":
+        from ..llm.deepseek import DeepSeekLLM
         return DeepSeekLLM()
     elif provider == "glm":
+        from ..llm.glm import GLMLLM
         return GLMLLM()
     else:
         raise ValueError(f"Unknown LLM provider: {provider}")
 
 
+def _pack_batches(
+    events: list[pysubs2.SSAEvent], max_chars: int, max_count: int
+) -> Iterator[list[pysubs2.SSAEvent]]:
+    """Split events into consecutive batches within both limits.
+
+    A single event longer than max_chars gets a batch of its own.
+    """
+    batch: list[pysubs2.SSAEvent] = []
+    batch_chars = 0
+    for event in events:
+        chars = len(event.text)
+        if batch and (
+            len(batch) >= max_count or batch_chars + chars > max_chars
+        ):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(event)
+        batch_chars += chars
+    if batch:
+        yield batch
+
+
+def _is_permanent_error(e: Exception) -> bool:
+    """Whether a provider error would fail the same way on every retry.
+
+    Requests rejected for being too long are not permanent, smaller
+    batches can still succeed.
+    """
+    if getattr(e, "status_code", None) not in PERMANENT_ERROR_STATUSES:
+        return False
+    message = str(e).lower()
+    return "context_length" not in message and "too long" not in message
+
+
+async def _translate_with_bisect(
+    llm: BaseLLM,
+    texts: list[str],
+    source_language: str,
+    target_language: str,
+    semaphore: asyncio.Semaphore,
+    depth: int = 0,
+) -> list[str]:
+    """Translate texts as one batch, splitting it in halves when that fails.
+
+    Each failed level backs off once, then translates both halves at the
+    same time. A single line that still fails is retried once on its own,
+    then kept untranslated. Errors no retry can fix (bad API key, unknown
+    model) are raised straight away. The semaphore is held only while a
+    request is in flight.
+    """
+    try:
+        async with semaphore:
+            return await llm.translate_batch_cached(
+                texts, source_language, target_language
+            )
+    except Exception as e:
+        if _is_permanent_error(e):
+            raise
+        logger.error(f"Batch translation of {len(texts)} lines failed: {e}")
+
+    await asyncio.sleep(min(2**depth, MAX_RETRY_BACKOFF))
+
+    if len(texts) > 1:
+        mid = len(texts) // 2
+        first, second = await asyncio.gather(
+            _translate_with_bisect(
+                llm, texts[:mid], source_language, target_language, semaphore, depth + 1
+            ),
+            _translate_with_bisect(
+                llm, texts[mid:], source_language, target_language, semaphore, depth + 1
+            ),
+        )
+        return first + second
+
+    try:
+        async with semaphore, llm.rate_limited(texts):
+            return [await llm.translate(texts[0], source_language, target_language)]
+    except Exception as e:
+        if _is_permanent_error(e):
+            raise
+        logger.error(f"Single translation failed: {e}")
+        return list(texts)  # Keep original on failure
+
+
 async def translate_subtitle_file(
     subtitle_path: str,
     output_path: str,
@@ -46,8 +142,9 @@ async def translate_subtitle_file(
     """Translate a subtitle file."""
     llm = get_llm(llm_provider)
 
-    # Parse subtitle with encoding detection
-    subs = subtitle_service.parse_subtitle(subtitle_path)
+    # Parse subtitle with encoding detection. Reading, detection and parsing
+    # are blocking, so they run in a worker thread.
+    subs = await asyncio.to_thread(subtitle_service.parse_subtitle, subtitle_path)
     total_events = len(subs.events)
 
     if total_events == 0:
@@ -55,41 +152,51 @@ async def translate_subtitle_file(
 
     logger.info(f"Translating {total_events} subtitle lines")
 
-    # Translate in batches
-    translated_texts = []
+    # Translate batches concurrently, up to the provider's request limit
+    concurrency = settings.translation_concurrency or llm.max_concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = list(
+        _pack_batches(
+            subs.events,
+            max_chars=settings.batch_max_chars or BATCH_MAX_CHARS,
+            max_count=settings.batch_max_count or BATCH_MAX_COUNT,
+        )
+    )
+    translated_count = 0
 
-    for i in range(0, total_events, BATCH_SIZE):
-        batch = subs.events[i : i + BATCH_SIZE]
+    async def translate_batch(batch: list[pysubs2.SSAEvent]) -> list[str]:
+        nonlocal translated_count
         texts = [event.text for event in batch]
 
-        try:
-            batch_translated = await llm.translate_batch(
-                texts, source_language, target_language
-            )
-            translated_texts.extend(batch_translated)
-        except Exception as e:
-            logger.error(f"Batch translation failed: {e}")
-            # Fallback to single translation
-            for text in texts:
-                try:
-                    translated = await llm.translate(
-                        text, source_language, target_language
-                    )
-                    translated_texts.append(translated)
-                except Exception as e2:
-                    logger.error(f"Single translation failed: {e2}")
-                    translated_texts.append(text)  # Keep original on failure
+        batch_translated = await _translate_with_bisect(
+            llm, texts, source_language, target_language, semaphore
+        )
 
         # Update progress
+        translated_count += len(batch)
         if progress_callback:
-            progress = int((len(translated_texts) / total_events) * 80) + 10
+            progress = int((translated_count / total_events) * 80) + 10
             await progress_callback(min(progress, 90))
 
-    # Create translated subtitle
-    translated_subs = deepcopy(subs)
-    for i, event in enumerate(translated_subs.events):
-        if i < len(translated_texts):
-            event.text = translated_texts[i]
+        return batch_translated
+
+    # gather keeps results in batch order. If one batch hits a permanent
+    # error the others are cancelled rather than left running.
+    tasks = [asyncio.ensure_future(translate_batch(batch)) for batch in batches]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    translated_texts = [text for batch_texts in results for text in batch_texts]
+
+    # Create translated subtitle. Only event texts change, so the file is a
+    # shallow copy with copied events.
+    translated_subs = copy(subs)
+    translated_subs.events = [event.copy() for event in subs.events]
+    for event, text in zip(translated_subs.events, translated_texts):
+        event.text = text
 
     if bilingual:
         # Create bilingual subtitle
@@ -97,8 +204,8 @@ async def translate_subtitle_file(
             subs, translated_subs, output_format=output_format
         )
 
-    # Save translated subtitle
-    translated_subs.save(output_path)
+    # Save translated subtitle (off the event loop)
+    await asyncio.to_thread(translated_subs.save, output_path)
     logger.info(f"Translated subtitle saved to {output_path}")
 
     return output_path
@@ -128,21 +235,27 @@ async def process_mkv_translation(
     # Select track
     if subtitle_track is None:
         # Use first text-based subtitle track
-        for track in info.tracks:
-            if track.codec not in ["hdmv_pgs_subtitle", "dvd_subtitle"]:
-                subtitle_track = track.index
-                break
-
-        if subtitle_track is None:
+        track = next(
+            (
+                t
+                for t in info.tracks
+                if t.codec not in subtitle_service.GRAPHICAL_CODECS
+            ),
+            None,
+        )
+        if track is None:
             raise ValueError("No text-based subtitle tracks found")
+        subtitle_track = track.index
 
     # Extract subtitle
     if progress_callback:
         await progress_callback(10)
 
     temp_subtitle = await subtitle_service.extract_subtitle(
-        mkv_path, subtitle_track
+        mkv_path, subtitle_track, track_info=info
     )
+    temp_translated = None
+    mux_output = None
 
     try:
         # Translate subtitle
@@ -152,7 +265,7 @@ async def process_mkv_translation(
         else:
             effective_format = output_format if output_format in ("srt", "ass") else "srt"
         temp_suffix = f".{effective_format}"
-        temp_translated = tempfile.mktemp(suffix=temp_suffix)
+        temp_translated = _temp_path_beside(mkv_path, temp_suffix)
 
         await translate_subtitle_file(
             temp_subtitle,
@@ -171,7 +284,7 @@ async def process_mkv_translation(
         if output_format in ("srt", "ass"):
             lang_tag = subtitle_service.get_language_tag(target_language)
             output_path = f"{base}.{lang_tag}.{output_format}"
-            shutil.move(temp_translated, output_path)
+            _replace_keeping_mode(temp_translated, output_path, mkv_path)
             if progress_callback:
                 await progress_callback(100)
             return output_path
@@ -182,7 +295,7 @@ async def process_mkv_translation(
 
         output_path = mkv_path if overwrite else f"{base}.translated{ext}"
         mux_output = (
-            tempfile.mktemp(suffix=ext) if overwrite else output_path
+            _temp_path_beside(mkv_path, ext) if overwrite else output_path
         )
 
         lang_code = subtitle_service.get_language_code(target_language)
@@ -197,7 +310,7 @@ async def process_mkv_translation(
         )
 
         if overwrite:
-            shutil.move(mux_output, output_path)
+            _replace_keeping_mode(mux_output, output_path, mkv_path)
             old_translated = f"{base}.translated{ext}"
             if os.path.exists(old_translated):
                 os.remove(old_translated)
@@ -209,6 +322,38 @@ async def process_mkv_translation(
 
     finally:
         # Cleanup temp files
-        for f in [temp_subtitle, temp_translated]:
-            if os.path.exists(f):
+        temp_files = [temp_subtitle, temp_translated]
+        if overwrite and mux_output:
+            temp_files.append(mux_output)
+        for f in temp_files:
+            if f and os.path.exists(f):
                 os.remove(f)
+
+
+def _temp_path_beside(path: str, suffix: str) -> str:
+    """Create an empty temp file in the directory of path and return its path.
+
+    Outputs written there are renamed into place without copying. The
+    ".translated." in the name keeps watchers and scans from picking it up.
+    """
+    directory, name = os.path.split(path)
+    prefix = f"{os.path.splitext(name)[0]}.translated."
+    fd, temp_path = tempfile.mkstemp(
+        suffix=suffix, prefix=prefix, dir=directory or "."
+    )
+    os.close(fd)
+    return temp_path
+
+
+def _replace_keeping_mode(temp_path: str, path: str, source_path: str):
+    """Move temp_path over path with the permissions path would normally have.
+
+    mkstemp files are owner-only. The result takes the mode of the file it
+    replaces, or that of the source video without execute bits.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        mode = os.stat(source_path).st_mode & 0o666
+    os.chmod(temp_path, stat.S_IMODE(mode))
+    os.replace(temp_path, path)
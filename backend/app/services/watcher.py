@@ -1,5 +1,10 @@
 import asyncio
+import concurrent.futures
 import os
+import re
+import threading
+import time
+from functools import lru_cache
 from typing import Callable, Awaitable, Optional
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
@@ -8,8 +13,19 @@ from . import subtitle as subtitle_service
 
 logger = logging.getLogger(__name__)
 
+# Files handed to the batch callback at a time during directory scans, and
+# batches a scan's walk may get ahead of their dispatch
+SCAN_BATCH_SIZE = 500
+SCAN_QUEUE_SIZE = 4
 
-def language_tokens(language: str) -> list[str]:
+# New files are handled once their size has not changed for this many
+# seconds (so copies in progress are not probed), checked at this interval
+STABLE_SECONDS = 2.0
+STABILITY_CHECK_INTERVAL = 1.0
+
+
+@lru_cache(maxsize=16)
+def language_tokens(language: str) -> tuple[str, ...]:
     """Return filename tokens for a target language."""
     base = language.lower().strip()
     tokens = {base}
@@ -44,18 +60,28 @@ def language_tokens(language: str) -> list[str]:
     elif base == "italian":
         tokens.update(["it", "ita", "italian"])
 
-    tokens.update(tag.lower() for tag in subtitle_service.get_known_language_tags())
-    return sorted(tokens)
+    tokens.update(subtitle_service.KNOWN_LANGUAGE_TAGS_LOWER)
+    # A tuple, since the cached result is shared between callers
+    return tuple(sorted(tokens))
 
 
 def has_target_language_marker(name: str, target_language: str) -> bool:
-    lower_name = name.lower()
-    for token in language_tokens(target_language):
-        if not token:
+    return _marker_pattern(target_language).search(name.lower()) is not None
+
+
+@lru_cache(maxsize=32)
+def _marker_pattern(target_language: str) -> re.Pattern:
+    """Compile the filename markers of a target language into one pattern.
+
+    Tokens of up to two letters only count between separators, longer ones
+    anywhere in the name.
+    """
+    markers = []
+    for t in language_tokens(target_language):
+        if not t:
             continue
-        t = token.lower()
         if len(t) <= 2:
-            patterns = [
+            markers.extend([
                 f".{t}.",
                 f"_{t}.",
                 f"-{t}.",
@@ -64,49 +90,66 @@ def has_target_language_marker(name: str, target_language: str) -> bool:
                 f" {t}.",
                 f".{t}-",
                 f".{t}_",
-            ]
-            if any(p in lower_name for p in patterns):
-                return True
+            ])
         else:
-            if t in lower_name:
-                return True
-    return False
+            markers.append(t)
+    return re.compile("|".join(re.escape(marker) for marker in markers))
 
 
-def is_generated_subtitle(name: str) -> bool:
-    """Check if a file appears to be a generated subtitle output."""
-    lower_name = name.lower()
-    if ".translated." in lower_name:
-        return True
-    if lower_name.endswith((".srt", ".ass")):
-        for tag in subtitle_service.get_known_language_tags():
-            if f".{tag.lower()}." in lower_name:
-                return True
-    return False
-
+# Names of our own outputs: "*.translated.*", or a ".srt"/".ass" file with a
+# ".tag." language marker somewhere in its name
+_GENERATED_RE = re.compile(
+    r"\.translated\.|\.(?:%s)\.(?:.*\.)?(?:srt|ass)\Z"
+    % "|".join(
+        re.escape(tag) for tag in subtitle_service.KNOWN_LANGUAGE_TAGS_LOWER
+    ),
+    re.IGNORECASE | re.DOTALL,
+)
 
-def has_matching_subtitle_for_mkv(mkv_path: str, target_language: str) -> bool:
-    base = os.path.splitext(os.path.basename(mkv_path))[0]
-    directory = os.path.dirname(mkv_path) or "."
-    base_lower = base.lower()
 
-    try:
-        for name in os.listdir(directory):
-            lower_name = name.lower()
-            if not lower_name.endswith((".srt", ".ass")):
-                continue
-            if not lower_name.startswith(base_lower + "."):
-                continue
-            if has_target_language_marker(name, target_language):
-                return True
-    except OSError:
-        return False
+def is_generated_subtitle(name: str) -> bool:
+    """Check if a file appears to be a generated subtitle output."""
+    return _GENERATED_RE.search(name) is not None
+
+
+def has_matching_subtitle_for_mkv(
+    mkv_path: str,
+    target_language: str,
+    lower_listing: Optional[list[str]] = None,
+) -> bool:
+    """Check for a target language subtitle next to an MKV file.
+
+    lower_listing, if given, holds the lowercased names in the MKV's
+    directory (at least its subtitle files) and saves listing it again.
+    """
+    if lower_listing is None:
+        directory = os.path.dirname(mkv_path) or "."
+        try:
+            lower_listing = [name.lower() for name in os.listdir(directory)]
+        except OSError:
+            return False
+
+    prefix = os.path.splitext(os.path.basename(mkv_path))[0].lower() + "."
+    markers = _marker_pattern(target_language)
+    for lower_name in lower_listing:
+        if (
+            lower_name.endswith((".srt", ".ass"))
+            and lower_name.startswith(prefix)
+            and markers.search(lower_name)
+        ):
+            return True
 
     return False
 
 
-def should_skip_file(file_path: str, target_language: str) -> bool:
-    lower_path = file_path.lower()
+def should_skip_file(
+    file_path: str,
+    target_language: str,
+    lower_listing: Optional[list[str]] = None,
+    lower_path: Optional[str] = None,
+) -> bool:
+    if lower_path is None:
+        lower_path = file_path.lower()
     if not lower_path.endswith((".mkv", ".srt", ".ass")):
         return True
     if ".translated." in lower_path:
@@ -114,10 +157,12 @@ def should_skip_file(file_path: str, target_language: str) -> bool:
     if lower_path.endswith((".srt", ".ass")):
         if is_generated_subtitle(lower_path):
             return True
-        if has_target_language_marker(file_path, target_language):
+        if _marker_pattern(target_language).search(lower_path):
             return True
     if lower_path.endswith(".mkv"):
-        if has_matching_subtitle_for_mkv(file_path, target_language):
+        if has_matching_subtitle_for_mkv(
+            file_path, target_language, lower_listing
+        ):
             return True
     return False
 
@@ -135,6 +180,10 @@ class MKVHandler(FileSystemEventHandler):
         self.target_language = target_language
         self.llm_provider = llm_provider
         self._processed_files: set[str] = set()
+        # path -> (last seen size, when that size was first seen)
+        self._pending: dict[str, tuple[int, float]] = {}
+        self._pending_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
 
     def on_created(self, event: FileCreatedEvent):
         if event.is_directory:
@@ -148,6 +197,56 @@ class MKVHandler(FileSystemEventHandler):
         if file_path in self._processed_files:
             return
 
+        # Wait for the file to finish being written before handling it
+        with self._pending_lock:
+            self._pending.setdefault(file_path, (-1, time.monotonic()))
+            if self._timer is None:
+                self._schedule_check()
+
+    def stop(self):
+        """Drop pending files and stop checking them."""
+        with self._pending_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending.clear()
+
+    def _schedule_check(self):
+        """Check pending files after the check interval (lock held)."""
+        self._timer = threading.Timer(STABILITY_CHECK_INTERVAL, self._check_pending)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _check_pending(self):
+        """Handle pending files whose size has stopped changing."""
+        now = time.monotonic()
+        ready = []
+        with self._pending_lock:
+            for file_path, (size, since) in list(self._pending.items()):
+                try:
+                    current_size = os.path.getsize(file_path)
+                except OSError:
+                    # Removed or renamed before it settled
+                    del self._pending[file_path]
+                    continue
+                if current_size != size:
+                    self._pending[file_path] = (current_size, now)
+                elif now - since >= STABLE_SECONDS:
+                    del self._pending[file_path]
+                    ready.append(file_path)
+
+            self._timer = None
+            if self._pending:
+                self._schedule_check()
+
+        for file_path in ready:
+            self._handle_file(file_path)
+
+    def _handle_file(self, file_path: str):
+        """Pass a finished new file to the callback unless it is skipped."""
+        if file_path in self._processed_files:
+            return
+
         if should_skip_file(file_path, self.target_language):
             return
 
@@ -165,6 +264,9 @@ class DirectoryWatcher:
         self._on_new_file: Optional[
             Callable[[str, str, str], Awaitable[None]]
         ] = None
+        self._on_new_files: Optional[
+            Callable[[list[str], str, str], Awaitable[int]]
+        ] = None
         self._loop: Optional[asyncio.AbstractEventLoop] = None
 
     def set_new_file_callback(
@@ -178,6 +280,17 @@ class DirectoryWatcher:
         self._on_new_file = callback
         self._loop = asyncio.get_running_loop()
 
+    def set_new_files_batch_callback(
+        self, callback: Callable[[list[str], str, str], Awaitable[int]]
+    ):
+        """Set callback for batches of files found by directory scans.
+
+        Args:
+            callback: async function(file_paths, target_language, llm_provider)
+                returning the number of tasks created
+        """
+        self._on_new_files = callback
+
     def start_watching(
         self,
         watcher_id: int,
@@ -220,6 +333,7 @@ class DirectoryWatcher:
         if watcher_id in self._observers:
             self._observers[watcher_id].stop()
             self._observers[watcher_id].join()
+            self._handlers[watcher_id].stop()
             del self._observers[watcher_id]
             del self._handlers[watcher_id]
             logger.info(f"Stopped watching watcher {watcher_id}")
@@ -243,33 +357,123 @@ class DirectoryWatcher:
             logger.warning(f"Cannot scan non-existent directory: {path}")
             return {"scanned": 0, "triggered": 0}
 
+        # The walk runs in a worker thread and hands batches over through a
+        # bounded queue. Dispatching one batch overlaps walking for the next,
+        # and a slow dispatch holds the walk back.
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Optional[list[str]]] = asyncio.Queue(
+            maxsize=SCAN_QUEUE_SIZE
+        )
+        stop = threading.Event()
+
+        def put(batch: Optional[list[str]]) -> bool:
+            """Queue a batch from the walker thread; False if the scan ended."""
+            future = asyncio.run_coroutine_threadsafe(queue.put(batch), loop)
+            while True:
+                try:
+                    future.result(timeout=1.0)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        walker = asyncio.ensure_future(
+            asyncio.to_thread(self._walk_for_files, path, target_language, put)
+        )
+
         scanned = 0
         triggered = 0
-
-        # Recursively walk through all subdirectories
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                if not f.lower().endswith((".mkv", ".srt", ".ass")):
-                    continue
-
-                file_path = os.path.join(root, f)
-                if should_skip_file(file_path, target_language):
-                    continue
-
-                scanned += 1
-
-                if self._on_new_file and self._loop:
-                    try:
-                        await self._on_new_file(file_path, target_language, llm_provider)
-                        triggered += 1
-                    except Exception as e:
-                        logger.error(f"Error processing {file_path}: {e}")
+        try:
+            while (batch := await queue.get()) is not None:
+                scanned += len(batch)
+                triggered += await self._dispatch_batch(
+                    batch, target_language, llm_provider
+                )
+            await walker
+        finally:
+            stop.set()
 
         logger.info(
             f"Scanned {path} (recursive): {scanned} files, {triggered} tasks triggered"
         )
         return {"scanned": scanned, "triggered": triggered}
 
+    def _walk_for_files(
+        self,
+        path: str,
+        target_language: str,
+        put: Callable[[Optional[list[str]]], bool],
+    ):
+        """Walk path and pass batches of files to translate to put.
+
+        Runs in a worker thread. Ends with put(None), or early if put
+        returns False.
+        """
+        batch: list[str] = []
+        try:
+            # Recursively walk through all subdirectories
+            for root, dirs, files in os.walk(path):
+                # Names are lowercased once per directory and reused for the
+                # skip checks. MKV checks look for sibling subtitles, so they
+                # get the walk's subtitle names rather than listing the
+                # directory per MKV.
+                lower_root = root.lower()
+                lower_files = [f.lower() for f in files]
+                subtitle_names = [
+                    f for f in lower_files if f.endswith((".srt", ".ass"))
+                ]
+                for f, lower_f in zip(files, lower_files):
+                    if not lower_f.endswith((".mkv", ".srt", ".ass")):
+                        continue
+
+                    file_path = os.path.join(root, f)
+                    if should_skip_file(
+                        file_path,
+                        target_language,
+                        subtitle_names,
+                        os.path.join(lower_root, lower_f),
+                    ):
+                        continue
+
+                    batch.append(file_path)
+
+                    if len(batch) >= SCAN_BATCH_SIZE:
+                        if not put(batch):
+                            return
+                        batch = []
+
+            if batch and not put(batch):
+                return
+        finally:
+            put(None)
+
+    async def _dispatch_batch(
+        self,
+        file_paths: list[str],
+        target_language: str,
+        llm_provider: str,
+    ) -> int:
+        """Hand scanned files to the batch callback, or one by one."""
+        if self._on_new_files:
+            try:
+                return await self._on_new_files(
+                    file_paths, target_language, llm_provider
+                )
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(file_paths)} files: {e}")
+                return 0
+
+        triggered = 0
+        if self._on_new_file and self._loop:
+            for file_path in file_paths:
+                try:
+                    await self._on_new_file(file_path, target_language, llm_provider)
+                    triggered += 1
+                except Exception as e:
+                    logger.error(f"Error processing {file_path}: {e}")
+        return triggered
+
 
 # Global watcher instance
 directory_watcher = DirectoryWatcher()
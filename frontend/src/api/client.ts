@@ -95,6 +95,8 @@ export interface Settings {
   subtitle_output_format: 'mkv' | 'srt' | 'ass';
   overwrite_mkv: boolean;
   max_concurrent_tasks: number;
+  llm_rpm_limit: number;
+  llm_tpm_limit: number;
 }
 
 export interface SubtitleTrack {